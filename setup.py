@@ -25,5 +25,5 @@ setup(name='xppy',
       license='LGPL',
       url='http://seis.bris.ac.uk/~enxjn/xppy',
       platforms='All-platforms',
-      packages=['xppy','xppy.parser','xppy.utils']
+      packages=['xppy','xppy.parser','xppy.utils','xppy.engine']
       )
@@ -0,0 +1,119 @@
+'''
+This file is part of XPPy.
+
+Copyright (c) 2009-2011, Jakub Nowacki
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the XPPy Developers nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+import numpy as np #@UnresolvedImport
+from xppy.utils.data import findSpikes, findADP
+
+def _findSpikesLoop(data, cols=[0,1], threshold=20, sampleThr=3):
+    '''
+    Reference: the sample by sample loop findSpikes replaced.
+    '''
+    st = 0
+    spb = []; spm = []; spe = []
+    sl_last = 0
+    spf = 0
+    for i in range(1,data.shape[0]):
+        dx,dy = data[i,cols] - data[i-1,cols]
+        sl = dy/dx
+        if spf == 1:
+            if np.sign(sl_last) != np.sign(sl):
+                spm.append(i-1)
+                spf = 2
+            sl_last = sl
+            continue
+        if spf == 2:
+            if np.abs(sl) > threshold and np.sign(sl) == -1:
+                spf = 3
+            continue
+        if spf == 3:
+            if (not np.abs(sl) > threshold) or np.sign(sl_last) != np.sign(sl):
+                spe.append(i-1)
+                spf = 0
+                st = 0
+            sl_last = sl
+            continue
+        if np.abs(sl) > threshold:
+            st += 1
+            if st >= sampleThr and sl > 0:
+                spb.append(i-st)
+                spf = 1
+        else:
+            st = 0
+        sl_last = sl
+    return (spb,spm,spe)
+
+def _findADPLoop(data, cols=[0,1], threshold=20, sampleThr=3):
+    '''
+    Reference: the sample by sample loop findADP replaced.
+    '''
+    (spb, spm, spe) = _findSpikesLoop(data, cols, threshold, sampleThr)
+    adp = []
+    for i in range(len(spe)):
+        dx,dy = data[spe[i],cols] - data[spe[i]-1,cols]
+        sl_last = dy/dx
+        if i+1 < len(spe):
+            j_end = spb[i+1]
+        else:
+            j_end = data.shape[0]
+        for j in range(spe[i]+1,j_end):
+            dx,dy = data[j,cols] - data[j-1,cols]
+            sl = dy/dx
+            if np.abs(sl) > np.abs(sl_last) and sl < 0:
+                if j-spe[i] > 2:
+                    adp.append(j)
+                break
+            sl_last = sl
+    return adp
+
+def _trace(rng, n=1000):
+    '''
+    Random spike train: jittered and sometimes repeated time steps, 
+    spikes of random width and height with an afterdepolarization, noise
+    and voltage rounding.
+    '''
+    dt = 0.1*(1+0.5*rng.uniform(-1, 1, n))
+    dt[rng.uniform(size=n) < 0.01] = 0
+    t = np.cumsum(dt)
+    v = -65+rng.normal(0, 0.3, n)
+    for c in rng.uniform(0, t[-1], rng.randint(0, 15)):
+        w = rng.uniform(0.1, 1.5)
+        v += rng.uniform(20, 100)*np.exp(-((t-c)/w)**2)
+        v += rng.uniform(0, 10)*np.exp(-((t-c-4*w)/(2*w))**2)
+    v = np.round(v, rng.randint(0, 4))
+    return np.column_stack((t, v))
+
+def test_spikes_equivalence():
+    rng = np.random.RandomState(0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for k in range(40):
+            data = _trace(rng)
+            for threshold in (5, 20, 60):
+                for sampleThr in (0, 1, 3, 5):
+                    args = ([0,1], threshold, sampleThr)
+                    assert findSpikes(data, *args) == _findSpikesLoop(data, *args)
+                    assert findADP(data, *args) == _findADPLoop(data, *args)
@@ -0,0 +1,138 @@
+'''
+This file is part of XPPy.
+
+Copyright (c) 2009-2011, Jakub Nowacki
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the XPPy Developers nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+import numpy as np #@UnresolvedImport
+from xppy.utils.solution import parseBifDiag, parseSolution, loadIndex, findSolutions, \
+     getSolution
+
+def _parseBifDiagLoop(file_name):
+    '''
+    Reference: the line by line parser parseBifDiag replaced.
+    '''
+    d = []
+    for l in open(file_name, 'r'):
+        ll = l.split()
+        if ll[0] != '0':
+            if ll[0].rfind('-') > 0:
+                ll_rest = ll[1:]
+                ll = ll[0].rsplit('-', 1)
+                ll[1] = '-'+ll[1]
+                ll.extend(ll_rest)
+            if int(ll[0]) > 0:
+                ll.append('0')
+            d.append(ll)
+    return np.array(d, float)
+
+_header = '   0    PT  TY LAB    PAR(1)        L2-NORM         U(1)\n'
+
+def _row(br, pt, ty, lab, vals):
+    return '%4i%6i%4i%4i' % (br, pt, ty, lab)+''.join(['%14.6E' % v for v in vals])+'\n'
+
+def _write(tmp_path, text):
+    fn = str(tmp_path / 'diagram.p')
+    f = open(fn, 'w')
+    f.write(text)
+    f.close()
+    return fn
+
+def test_normal_branches_only(tmp_path):
+    fn = _write(tmp_path, _header+''.join(
+        [_row(1, i, 0, 0, [0.1*i, 1.0, -2.0]) for i in range(1, 4)]))
+    d = parseBifDiag(fn)
+    assert d.shape == (3, 8)
+    assert np.array_equal(d, _parseBifDiagLoop(fn))
+
+def test_periodic_branches_only(tmp_path):
+    fn = _write(tmp_path, _header+''.join(
+        [_row(-2, i, 0, 0, [0.1*i, 1.0, -2.0, 5.0]) for i in range(1, 4)]))
+    d = parseBifDiag(fn)
+    assert d.shape == (3, 8)
+    assert np.array_equal(d, _parseBifDiagLoop(fn))
+
+def test_random_diagrams(tmp_path):
+    rng = np.random.RandomState(0)
+    for k in range(20):
+        text = ''
+        for b in range(rng.randint(1, 5)):
+            br = rng.choice([1, -1])*(b+1)
+            text += _header
+            for i in range(rng.randint(0, 50)):
+                # Wide negative point numbers merge with the branch number
+                pt = rng.choice([1, -1])*rng.randint(1, 100000)
+                vals = rng.standard_normal(6 if br > 0 else 7)*10.0**rng.randint(-5, 5)
+                text += _row(br, pt, rng.randint(0, 10), rng.randint(0, 20), vals)
+        fn = _write(tmp_path, text)
+        d = parseBifDiag(fn)
+        if d.shape[0] > 0:
+            assert np.array_equal(d, _parseBifDiagLoop(fn))
+        (ints, vals) = parseBifDiag(fn, integers=True)
+        assert np.array_equal(ints, d[:,:4]) and np.array_equal(vals, d[:,4:])
+
+def _writeSolutions(tmp_path, nsol=6, ntpl=3, ndim=2):
+    '''
+    Writes AUTO solution file (fort.8 format) with nsol solutions.
+    '''
+    def wrap(vals):
+        return [''.join(['%19.10E' % v for v in vals[i:i+7]]) 
+                for i in range(0, len(vals), 7)]
+    rng = np.random.RandomState(0)
+    text = ''
+    for k in range(nsol):
+        itp = [4, 5, 9][k % 3]
+        lines = []
+        for r in rng.standard_normal((ntpl, ndim+1)):
+            lines += wrap(r)
+        lines.append('    1    2')
+        lines += wrap(rng.standard_normal(2))
+        for r in rng.standard_normal((ntpl, ndim)):
+            lines += wrap(r)
+        lines += wrap(rng.standard_normal(10))
+        text += '%5d%5d%5d%5d%5d%5d%8d%5d%8d%5d%5d%5d\n' % (1+k%2, k+1, itp, k+1, 
+                2, 2, ntpl, ndim+1, len(lines), 10, 4, 10)
+        text += '\n'.join(lines)+'\n'
+    fn = str(tmp_path / 'fort.8')
+    f = open(fn, 'w')
+    f.write(text)
+    f.close()
+    return fn
+
+def test_find_solutions_array_filters(tmp_path):
+    fn = _writeSolutions(tmp_path)
+    index = loadIndex(fn)
+    labels = index[:,4]
+    assert np.array_equal(findSolutions(fn, labels=labels), index)
+    rows = findSolutions(fn, labels=labels[1:3], types=np.array([5, 9]), 
+                         branches=np.array([1, 2]))
+    assert np.array_equal(rows, index[1:3])
+    assert len(findSolutions(fn, types=np.array([4]))) == 2
+    assert getSolution(fn, int(labels[-1])) != None
+
+def test_parse_solution_array_types(tmp_path):
+    fn = _writeSolutions(tmp_path)
+    assert len(parseSolution(fn, types=np.array([4, 5]))) == 4
+    assert len(parseSolution(fn, types=None)) == 6
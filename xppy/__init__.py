@@ -1,3 +1,3 @@
 from xppy.parser import *
-__all__ = ['parser', 'utils']
+__all__ = ['parser', 'utils', 'engine']
 __version__ = '0.7.0'
@@ -0,0 +1,5 @@
+from xppy.engine.script import *
+from xppy.engine.graph import *
+from xppy.engine.model import *
+from xppy.engine.solve import *
+from xppy.engine.cgen import *
@@ -0,0 +1,322 @@
+'''
+This file is part of XPPy.
+
+Copyright (c) 2009-2011, Jakub Nowacki
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the XPPy Developers nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+import os
+import ast
+import ctypes
+import hashlib
+import shutil
+import subprocess
+import tempfile
+import threading
+import numpy as np #@UnresolvedImport
+
+# XPP functions (see model.functions) in C
+c_functions = {'sin': 'sin', 'cos': 'cos', 'tan': 'tan', 'asin': 'asin', 
+               'acos': 'acos', 'atan': 'atan', 'atan2': 'atan2', 
+               'sinh': 'sinh', 'cosh': 'cosh', 'tanh': 'tanh', 'exp': 'exp',
+               'ln': 'log', 'log': 'log', 'log10': 'log10', 'sqrt': 'sqrt',
+               'abs': 'fabs', 'fabs': 'fabs', 'sign': 'xsign', 'heav': 'xheav',
+               'max': 'fmax', 'min': 'fmin', 'mod': 'xmod', 'flr': 'floor',
+               'ceil': 'ceil'}
+
+_c_binops = {ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/',
+             ast.BitAnd: '&&', ast.BitOr: '||'}
+_c_cmpops = {ast.Lt: '<', ast.LtE: '<=', ast.Gt: '>', ast.GtE: '>=',
+             ast.Eq: '==', ast.NotEq: '!='}
+
+_c_prelude = '''#include <math.h>
+
+static double xheav(double x) { return x >= 0.0 ? 1.0 : 0.0; }
+static double xsign(double x) { return (x > 0.0) - (x < 0.0); }
+static double xmod(double a, double b) { return a - b*floor(a/b); }
+static double xipow(double x, int n)
+{
+    double r = 1.0;
+    int k = n < 0 ? -n : n;
+    while (k--) r *= x;
+    return n < 0 ? 1.0/r : r;
+}
+'''
+
+_c_fixed = '''
+static void axpy(long m, double *z, const double *y, double a, const double *x)
+{
+    for (long i = 0; i < m; i++) z[i] = y[i] + a*x[i];
+}
+
+static int outside(long m, const double *y, double bound)
+{
+    if (bound < 0.0) return 0;
+    for (long i = 0; i < m; i++)
+        if (!(fabs(y[i]) <= bound)) return 1;
+    return 0;
+}
+
+/* Fixed step integration (meth: 0 Euler, 1 modified Euler, 2 RK4) of
+   n trajectories, storing the state every njmp steps in out; returns the
+   number of stored states, negative if the integration got out of bounds */
+long fixed(int meth, long n, double t0, double dt, long nsteps, long njmp,
+           double bound, double *y, const double *P, double *out, double *w)
+{
+    long m = NV*n, rows = 1;
+    double *k1 = w, *k2 = w+m, *k3 = w+2*m, *k4 = w+3*m, *z = w+4*m;
+    for (long i = 0; i < m; i++) out[i] = y[i];
+    for (long k = 1; k <= nsteps; k++) {
+        double t = t0 + (k-1)*dt;
+        rhs(n, t, y, P, k1);
+        if (meth == 0) {
+            axpy(m, y, y, dt, k1);
+        } else if (meth == 1) {
+            axpy(m, z, y, dt, k1);
+            rhs(n, t+dt, z, P, k2);
+            for (long i = 0; i < m; i++) y[i] += 0.5*dt*(k1[i]+k2[i]);
+        } else {
+            axpy(m, z, y, 0.5*dt, k1);
+            rhs(n, t+0.5*dt, z, P, k2);
+            axpy(m, z, y, 0.5*dt, k2);
+            rhs(n, t+0.5*dt, z, P, k3);
+            axpy(m, z, y, dt, k3);
+            rhs(n, t+dt, z, P, k4);
+            for (long i = 0; i < m; i++)
+                y[i] += dt/6.0*(k1[i]+2.0*(k2[i]+k3[i])+k4[i]);
+        }
+        if (k % njmp == 0) {
+            if (outside(m, y, bound)) return -rows;
+            for (long i = 0; i < m; i++) out[rows*m+i] = y[i];
+            rows++;
+        }
+    }
+    return rows;
+}
+'''
+
+def cExpr(expr):
+    '''
+    Function translates a Python expression generated by translate (see 
+    model) into C.
+    '''
+    return cAst(ast.parse(expr, mode='eval').body)
+
+def cAst(node):
+    '''
+    Function translates Python expression AST into C.
+    '''
+    return _c(node)
+
+def _c(node):
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return repr(float(node.value))
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.BinOp):
+        (a, b) = (_c(node.left), _c(node.right))
+        if isinstance(node.op, ast.Pow):
+            e = node.right
+            if isinstance(e, ast.UnaryOp) and isinstance(e.op, ast.USub) and \
+               isinstance(e.operand, ast.Constant):
+                e = ast.Constant(-e.operand.value)
+            if isinstance(e, ast.Constant) and float(e.value).is_integer() and \
+               abs(e.value) <= 16:
+                return 'xipow(%s, %i)' % (a, int(e.value))
+            return 'pow(%s, %s)' % (a, b)
+        op = _c_binops.get(type(node.op))
+        if op != None:
+            return '(%s %s %s)' % (a, op, b)
+    if isinstance(node, ast.UnaryOp):
+        a = _c(node.operand)
+        if isinstance(node.op, ast.USub):
+            return '(-%s)' % a
+        if isinstance(node.op, ast.UAdd):
+            return a
+        if isinstance(node.op, ast.Not):
+            return '(!%s)' % a
+    if isinstance(node, ast.Compare):
+        terms = []
+        left = _c(node.left)
+        for (op, right) in zip(node.ops, node.comparators):
+            right = _c(right)
+            terms.append('(%s %s %s)' % (left, _c_cmpops[type(op)], right))
+            left = right
+        return '(%s)' % ' && '.join(terms)
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+        f = node.func.id
+        args = [_c(a) for a in node.args]
+        if f == 'where':
+            return '(%s ? %s : %s)' % tuple(args)
+        if f == 'not':
+            return '(!%s)' % args[0]
+        if f in c_functions:
+            return '%s(%s)' % (c_functions[f], ', '.join(args))
+    raise ValueError('Expression not supported by the C backend: '+ast.unparse(node))
+
+def cSource(system):
+    '''
+    Function returns the C source of OdeSystem system (user functions are
+    inlined and shared subexpressions evaluated once, see ExprGraph): the
+    right hand side rhs(n, t, Y, P, DY) of n trajectories (states stored as (variables, n)
+    array, parameters as (n, parameters) one, so that the parameters of 
+    a trajectory are contiguous) and the fixed step integrator fixed.
+    '''
+    pars = ['_'+n.lower() for n in system.pars]
+    def unpack(names, arr, stride):
+        return ['    const double %s = %s[%i%s];' % (n, arr, i, stride) 
+                for (i, n) in enumerate(names)]
+
+    src = [_c_prelude, '#define NV %i' % len(system.vars), 
+           '#define NP %i' % len(pars), '']
+    src += ['static void rhs1(double _t, const double *Y, const double *P,'
+            ' long s, double *DY)', '{']
+    src += unpack(pars, 'P', '')
+    src += unpack(['_'+n.lower() for n in system.vars], 'Y', '*s')
+    (temps, outs) = system.graph.code(cAst)
+    src += ['    const double %s = %s;' % t for t in temps]
+    for (i, e) in enumerate(outs):
+        src.append('    DY[%i*s] = %s;' % (i, e))
+    src += ['}', '',
+            'void rhs(long n, double t, const double *Y, const double *P,'
+            ' double *DY)', '{',
+            '    for (long k = 0; k < n; k++)',
+            '        rhs1(t, Y+k, P+k*NP, n, DY+k);', '}']
+    return '\n'.join(src)+'\n'+_c_fixed
+
+def cacheDir():
+    '''
+    Function returns the directory of compiled models: XPPY_CACHE 
+    environment variable or ~/.cache/xppy.
+    '''
+    return os.environ.get('XPPY_CACHE', 
+                          os.path.join(os.path.expanduser('~'), '.cache', 'xppy'))
+
+class CLibrary:
+    '''
+    Class wraps the shared library compiled from an OdeSystem.
+    '''
+    def __init__(self, lib_file, nv):
+        '''
+        Constructor; loads the library lib_file.
+        '''
+        self.file = lib_file
+        self.nv = nv
+        self.lib = ctypes.CDLL(lib_file)
+        dp = ctypes.POINTER(ctypes.c_double)
+        self.lib.rhs.argtypes = [ctypes.c_long, ctypes.c_double, dp, dp, dp]
+        self.lib.rhs.restype = None
+        self.lib.fixed.argtypes = [ctypes.c_int, ctypes.c_long, ctypes.c_double,
+                                   ctypes.c_double, ctypes.c_long, ctypes.c_long,
+                                   ctypes.c_double, dp, dp, dp, dp]
+        self.lib.fixed.restype = ctypes.c_long
+
+    @staticmethod
+    def params(p, n):
+        '''
+        Function returns parameter values p (scalars or arrays of shape 
+        (n,)) as a contiguous (n, parameters) array.
+        '''
+        return np.ascontiguousarray(np.array([np.broadcast_to(np.asarray(v, dtype=float), (n,))
+                                              for v in p], dtype=float).T)
+
+    def rhs(self, t, y, P):
+        '''
+        Function returns the derivatives of state y (contiguous array of 
+        shape (variables,) or (variables, n)); P as returned by params.
+        '''
+        y = np.ascontiguousarray(y, dtype=float)
+        dy = np.empty_like(y)
+        n = 1 if y.ndim == 1 else y.shape[1]
+        self.lib.rhs(n, t, _ptr(y), _ptr(P), _ptr(dy))
+        return dy
+
+    def fixed(self, meth, y, P, t0, dt, nsteps, njmp, bound, out):
+        '''
+        Function integrates y (changed in place) with the fixed step method
+        meth (0 Euler, 1 modified Euler, 2 RK4), storing the states in out;
+        returns the number of stored states, negative if the integration
+        got out of bounds.
+        '''
+        n = 1 if y.ndim == 1 else y.shape[1]
+        w = np.empty(5*y.size)
+        return self.lib.fixed(meth, n, t0, dt, nsteps, njmp, 
+                              -1.0 if bound == None else bound, _ptr(y),
+                              _ptr(P), _ptr(out), _ptr(w))
+
+def _ptr(a):
+    return a.ctypes.data_as(ctypes.POINTER(ctypes.c_double))
+
+# Loaded libraries: source hash -> CLibrary
+_libs = {}
+_libs_lock = threading.Lock()
+
+def compileC(system, cc=None, cache_dir=None):
+    '''
+    Function compiles OdeSystem system into a shared library (cached in 
+    cache_dir, by default see cacheDir, under the hash of its source) and
+    returns CLibrary, or None if there is no C compiler (cc, by default CC
+    environment variable or cc) or the compilation fails.
+    '''
+    if cc == None:
+        cc = os.environ.get('CC', 'cc')
+    if shutil.which(cc) == None:
+        return None
+    try:
+        src = cSource(system)
+    except ValueError as e:
+        print('Warning! '+str(e))
+        return None
+    key = hashlib.sha256((cc+'\0'+src).encode()).hexdigest()
+    with _libs_lock:
+        lib = _libs.get(key)
+    if lib != None:
+        return lib
+    if cache_dir == None:
+        cache_dir = cacheDir()
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+    lib_file = os.path.join(cache_dir, 'xppy_'+key[:24]+'.so')
+    if not os.path.exists(lib_file):
+        tmp = tempfile.mkdtemp(dir=cache_dir)
+        try:
+            c_file = os.path.join(tmp, 'model.c')
+            f = open(c_file, 'w')
+            f.write(src)
+            f.close()
+            so_file = os.path.join(tmp, 'model.so')
+            p = subprocess.run([cc, '-O2', '-shared', '-fPIC', '-o', so_file,
+                                c_file, '-lm'], stdout=subprocess.PIPE, 
+                               stderr=subprocess.STDOUT)
+            if p.returncode != 0:
+                print('Warning! C compilation failed:\n'+p.stdout.decode(errors='replace'))
+                return None
+            # Concurrent builds of the same model do not clash
+            os.replace(so_file, lib_file)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+    lib = CLibrary(lib_file, len(system.vars))
+    with _libs_lock:
+        _libs[key] = lib
+    return lib
@@ -0,0 +1,181 @@
+'''
+This file is part of XPPy.
+
+Copyright (c) 2009-2011, Jakub Nowacki
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the XPPy Developers nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+import ast
+
+class ExprGraph:
+    '''
+    Class holds equations (expressions as returned by translate, see 
+    model) as a graph of unique subexpressions: user functions are inlined,
+    references to derived variables are replaced by their definitions and 
+    equal subexpressions are stored once. Nodes are numbered in the order 
+    of evaluation (each one follows its operands). Subexpressions used more
+    than once (e.g. derived variables or the same function call in several
+    equations) are scheduled as temporaries, so each is evaluated once.
+    '''
+    def __init__(self, outputs, derived=[], functions=[]):
+        '''
+        Constructor; outputs is the list of expressions to evaluate, derived
+        a list of (name, expression) of derived variables and functions 
+        a list of (name, arguments, expression) of user functions (names
+        as in translate, without the '_' prefix).
+        '''
+        self.nodes = []   # node keys: (kind, operator, operands...)
+        self.index = {}   # node key -> number
+        self.__derived = dict([('_'+n, e) for (n, e) in derived])
+        self.__functions = dict([('_'+n, (['_'+a for a in args], 
+                                          ast.parse(e, mode='eval').body))
+                                 for (n, args, e) in functions])
+        self.__done = {}  # derived variable -> node
+        self.__stack = [] # derived variables and functions being built
+        self.outputs = [self.__build(ast.parse(e, mode='eval').body, {}) 
+                        for e in outputs]
+        self.temps = self.__schedule()
+
+    def __node(self, key):
+        i = self.index.get(key)
+        if i == None:
+            i = len(self.nodes)
+            self.nodes.append(key)
+            self.index[key] = i
+        return i
+
+    def __enter(self, name):
+        if name in self.__stack:
+            raise ValueError('Circular definition of: '+
+                             ' -> '.join([n[1:] for n in self.__stack+[name]]))
+        self.__stack.append(name)
+
+    def __build(self, node, env):
+        if isinstance(node, ast.Name):
+            if node.id in env:
+                return env[node.id]
+            if node.id in self.__derived:
+                i = self.__done.get(node.id)
+                if i == None:
+                    self.__enter(node.id)
+                    e = ast.parse(self.__derived[node.id], mode='eval').body
+                    i = self.__build(e, {})
+                    self.__stack.pop()
+                    self.__done[node.id] = i
+                return i
+            return self.__node(('name', node.id))
+        if isinstance(node, ast.Constant):
+            return self.__node(('const', float(node.value)))
+        if isinstance(node, ast.BinOp):
+            return self.__node(('bin', type(node.op).__name__,
+                                self.__build(node.left, env),
+                                self.__build(node.right, env)))
+        if isinstance(node, ast.UnaryOp):
+            a = self.__build(node.operand, env)
+            if isinstance(node.op, ast.UAdd):
+                return a
+            return self.__node(('unary', type(node.op).__name__, a))
+        if isinstance(node, ast.Compare):
+            ops = tuple([type(op).__name__ for op in node.ops])
+            args = [self.__build(node.left, env)] + \
+                   [self.__build(c, env) for c in node.comparators]
+            return self.__node(('cmp', ops)+tuple(args))
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+            args = [self.__build(a, env) for a in node.args]
+            f = node.func.id
+            if f in self.__functions:
+                (names, body) = self.__functions[f]
+                if len(names) != len(args):
+                    raise ValueError('Wrong number of arguments of function: '+f[1:])
+                self.__enter(f)
+                i = self.__build(body, dict(zip(names, args)))
+                self.__stack.pop()
+                return i
+            return self.__node(('call', f)+tuple(args))
+        raise ValueError('Expression not supported: '+ast.unparse(node))
+
+    def operands(self, i):
+        '''
+        Function returns the operand nodes of node i.
+        '''
+        key = self.nodes[i]
+        if key[0] in ('name', 'const'):
+            return ()
+        return key[2:]
+
+    def __schedule(self):
+        '''
+        Function returns the (ordered) list of nodes evaluated as 
+        temporaries: compound nodes with more than one use.
+        '''
+        uses = [0]*len(self.nodes)
+        seen = [False]*len(self.nodes)
+        stack = list(self.outputs)
+        for i in self.outputs:
+            uses[i] += 1
+        while len(stack) > 0:
+            i = stack.pop()
+            if seen[i]:
+                continue
+            seen[i] = True
+            for j in self.operands(i):
+                uses[j] += 1
+                stack.append(j)
+        return [i for i in range(len(self.nodes)) 
+                if uses[i] > 1 and self.nodes[i][0] not in ('name', 'const')]
+
+    def expr(self, i, temps=None, define=False):
+        '''
+        Function returns the AST of node i, referring to the temporaries
+        (by default, the scheduled ones) by names T<node>; if define=True
+        node i itself is expanded even if it is a temporary.
+        '''
+        if temps == None:
+            temps = set(self.temps)
+        if i in temps and not define:
+            return ast.Name('T%i' % i, ast.Load())
+        key = self.nodes[i]
+        args = [self.expr(j, temps) for j in self.operands(i)]
+        if key[0] == 'name':
+            return ast.Name(key[1], ast.Load())
+        if key[0] == 'const':
+            return ast.Constant(key[1])
+        if key[0] == 'bin':
+            return ast.BinOp(args[0], getattr(ast, key[1])(), args[1])
+        if key[0] == 'unary':
+            return ast.UnaryOp(getattr(ast, key[1])(), args[0])
+        if key[0] == 'cmp':
+            return ast.Compare(args[0], [getattr(ast, op)() for op in key[1]],
+                               args[1:])
+        return ast.Call(ast.Name(key[1], ast.Load()), args, [])
+
+    def code(self, emit=ast.unparse):
+        '''
+        Function returns the evaluation of the outputs as (temporaries, 
+        outputs): a list of (name, expression) and a list of expressions;
+        emit converts AST to the target language (by default Python).
+        '''
+        temps = set(self.temps)
+        return ([('T%i' % i, emit(self.expr(i, temps, True))) for i in self.temps],
+                [emit(self.expr(i, temps)) for i in self.outputs])
@@ -0,0 +1,332 @@
+'''
+This file is part of XPPy.
+
+Copyright (c) 2009-2011, Jakub Nowacki
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the XPPy Developers nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+import os
+import re
+import threading
+import numpy as np #@UnresolvedImport
+from xppy.engine.script import parseScript, closingBracket
+from xppy.engine.graph import ExprGraph
+
+# XPP functions and their NumPy equivalents
+def heav(x):
+    return np.greater_equal(x, 0)*1.0
+
+functions = {'sin': np.sin, 'cos': np.cos, 'tan': np.tan, 'asin': np.arcsin,
+             'acos': np.arccos, 'atan': np.arctan, 'atan2': np.arctan2,
+             'sinh': np.sinh, 'cosh': np.cosh, 'tanh': np.tanh, 
+             'exp': np.exp, 'ln': np.log, 'log': np.log, 'log10': np.log10,
+             'sqrt': np.sqrt, 'abs': np.abs, 'fabs': np.abs, 'sign': np.sign,
+             'heav': heav, 'max': np.maximum, 'min': np.minimum, 
+             'mod': np.mod, 'flr': np.floor, 'ceil': np.ceil, 
+             'not': np.logical_not, 'where': np.where}
+
+# Options used by the integrators and their XPP defaults (bound=None
+# disables the bound check)
+options = {'total': 20.0, 'dt': 0.05, 't0': 0.0, 'trans': 0.0, 'njmp': 1,
+           'meth': 'rungekutta', 'toler': 0.001, 'atoler': 0.001, 
+           'dtmin': 1e-12, 'dtmax': 1.0, 'bound': 100.0}
+
+_token_re = re.compile(r'(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?|[A-Za-z_]\w*|'
+                       r'\*\*|<=|>=|==|!=|\S')
+_if_re = re.compile(r'(?<![\w.])if\(', re.I)
+
+def _ifThenElse(expr):
+    '''
+    Function rewrites if(c)then(a)else(b) expressions as where(c,a,b).
+    '''
+    m = _if_re.search(expr)
+    while m != None:
+        i = m.start()
+        c = closingBracket(expr, i+2)
+        if expr[c+1:c+6].lower() != 'then(':
+            raise ValueError('Expected then(...) in: '+expr)
+        t = closingBracket(expr, c+5)
+        if expr[t+1:t+6].lower() != 'else(':
+            raise ValueError('Expected else(...) in: '+expr)
+        e = closingBracket(expr, t+5)
+        expr = expr[:i]+'where('+expr[i+3:c]+','+expr[c+6:t]+','+ \
+               expr[t+6:e]+')'+expr[e+1:]
+        m = _if_re.search(expr)
+    return expr
+
+def _logic(tokens, i=0, depth=0):
+    '''
+    Function makes XPP logical operators (& and |) elementwise: their
+    operands are compared with 0, as they bind weaker than comparisons in
+    XPP but stronger in Python. Returns the tokens up to the closing
+    bracket of the level and the position of it.
+    '''
+    out = []
+    ops = [[]]
+    seps = []
+    def join():
+        if len(seps) == 0:
+            return ops[0]
+        ret = []
+        for (k, op) in enumerate(ops):
+            ret += ['(', '('] + op + [')', '!=', '0', ')']
+            if k < len(seps):
+                ret.append(seps[k])
+        return ret
+
+    while i < len(tokens):
+        tok = tokens[i]
+        if tok == '(':
+            (inner, i) = _logic(tokens, i+1, depth+1)
+            ops[-1] += ['('] + inner + [')']
+        elif tok == ')':
+            if depth == 0:
+                raise ValueError('Unbalanced brackets: '+''.join(tokens))
+            return (out+join(), i)
+        elif tok in ('&', '|'):
+            seps.append(tok)
+            ops.append([])
+        elif tok == ',':
+            out += join() + [',']
+            ops[:] = [[]]
+            del seps[:]
+        else:
+            ops[-1].append(tok)
+        i += 1
+    if depth > 0:
+        raise ValueError('Unbalanced brackets: '+''.join(tokens))
+    return (out+join(), i)
+
+def translate(expr):
+    '''
+    Function translates XPP expression into a Python (NumPy) expression 
+    and returns it with the set of names (lower case) it refers to. 
+    Names are case insensitive; in the translation they are lower case 
+    and prefixed with '_', time is _t and XPP functions are not prefixed 
+    (see functions); upper case names are free for the generated code.
+    '''
+    tokens = _token_re.findall(_ifThenElse(expr.replace(' ', '')))
+    names = set()
+    for (i, tok) in enumerate(tokens):
+        if tok == '^':
+            tokens[i] = '**'
+        elif tok[0].isalpha() or tok[0] == '_':
+            l = tok.lower()
+            call = i+1 < len(tokens) and tokens[i+1] == '('
+            if call and l in functions:
+                tokens[i] = l
+            elif l == 't':
+                tokens[i] = '_t'
+            else:
+                names.add(l)
+                tokens[i] = '_'+l
+    return (''.join(_logic(tokens)[0]), names)
+
+class OdeSystem:
+    '''
+    Class holds an ode file compiled into Python (NumPy) functions: 
+    rhs(t, y, p) returns the time derivatives of state y (state variables 
+    along the first axis) and aux(t, y, p) the auxiliary variables; p is 
+    the sequence of parameter values. The functions are elementwise, so 
+    t, y rows and p items can be arrays. Use compileOde to get a cached 
+    system.
+    '''
+    def __init__(self, ode_file):
+        '''
+        Constructor
+        '''
+        self.file = ode_file
+        self.script = parseScript(ode_file)
+        s = self.script
+        for line in s['unhandled']:
+            raise ValueError('Not supported by the engine: '+line)
+        self.pars = list(s['parameters'].keys())
+        self.parValues = [float(v) for v in s['parameters'].values()]
+        self.vars = list(s['time_derivatives'].keys())
+        if len(self.vars) == 0:
+            raise ValueError('No differential equations in: '+ode_file)
+        self.aux = list(s['auxiliary_variables'].keys())
+        inits = dict([(k.lower(), v) for (k, v) in s['initial_values'].items()])
+        self.inits = np.array([inits.get(v.lower(), 0.0) for v in self.vars])
+        self.options = dict(options)
+        self.options.update(s['settings'])
+        # Variables descriptor, as in the output file
+        desc = [['time', 0], ['t', 0], [0, 'time']]
+        for (i, n) in enumerate(self.vars+self.aux):
+            desc += [[n, i+1], [i+1, n]]
+        self.desc = dict(desc)
+        self._equations()
+        self.source = self._source()
+        ns = dict(functions, empty=np.empty, shape=np.shape)
+        exec(compile(self.source, '<'+ode_file+'>', 'exec'), ns)
+        self.rhs = ns['rhs']
+        self.auxFun = ns['aux']
+        self.__index = dict([(n.lower(), i) for (i, n) in enumerate(self.pars)])
+        self.__vindex = dict([(n.lower(), i) for (i, n) in enumerate(self.vars)])
+
+    def _equations(self):
+        '''
+        Function translates the equations (see translate); sets functions,
+        a list of (name, arguments, expression), derived, a list of 
+        (name, expression), derivatives and auxExprs, the lists of 
+        expressions, and graph and auxGraph, their expression graphs 
+        (see ExprGraph) used to generate the code.
+        '''
+        s = self.script
+        derived = dict(s['derived_variables'])
+        for (n, c) in s['conditional_derived_variables'].items():
+            derived[n] = 'if(%s)then(%s)else(%s)' % \
+                         (c['condition'], c['value_true'], c['value_false'])
+        exprs = {}
+        refs = {}
+        for (n, e) in derived.items():
+            (exprs[n.lower()], refs[n.lower()]) = translate(e)
+        known = set([n.lower() for n in self.pars+self.vars+list(derived)])
+        
+        self.functions = []
+        for (n, f) in s['functions'].items():
+            args = [a.strip().lower() for a in f['arguments']]
+            self.functions.append((n.lower(), args, translate(f['value'])[0]))
+            known.add(n.lower())
+        
+        def check(name, r):
+            if not r <= known:
+                raise ValueError('Unknown names in %s: %s' % 
+                                 (name, ', '.join(sorted(r-known))))
+        for n in exprs:
+            check(n, refs[n])
+        self.derived = list(exprs.items())
+        self.derivatives = []
+        for (n, e) in s['time_derivatives'].items():
+            (e, r) = translate(e)
+            check(n+"'", r)
+            self.derivatives.append(e)
+        self.auxExprs = []
+        for (n, e) in s['auxiliary_variables'].items():
+            (e, r) = translate(e)
+            check(n, r)
+            self.auxExprs.append(e)
+        self.graph = ExprGraph(self.derivatives, self.derived, self.functions)
+        self.auxGraph = ExprGraph(self.auxExprs, self.derived, self.functions)
+
+    def _source(self):
+        '''
+        Function returns the Python source of rhs and aux functions; shared
+        subexpressions are evaluated once (see ExprGraph).
+        '''
+        head = ['    (%s,) = P' % ', '.join(['_'+n.lower() for n in self.pars]),
+                '    (%s,) = Y' % ', '.join(['_'+n.lower() for n in self.vars])]
+        (temps, outs) = self.graph.code()
+        src = ['def rhs(_t, Y, P):'] + head
+        src += ['    %s = %s' % t for t in temps]
+        src.append('    DY = empty(shape(Y))')
+        for (i, e) in enumerate(outs):
+            src.append('    DY[%i] = %s' % (i, e))
+        src.append('    return DY')
+        (temps, outs) = self.auxGraph.code()
+        src += ['', 'def aux(_t, Y, P):'] + head
+        src += ['    %s = %s' % t for t in temps]
+        src.append('    return (%s)' % ''.join([e+', ' for e in outs]))
+        return '\n'.join(src)+'\n'
+
+    def parameters(self, new_pars=None):
+        '''
+        Function returns the list of parameter values, with new_pars
+        dictionary {name: value} applied (names are case insensitive).
+        '''
+        p = list(self.parValues)
+        if new_pars:
+            for (n, v) in new_pars.items():
+                p[self.parIndex(n)] = v
+        return p
+
+    def initial(self, new_inits=None):
+        '''
+        Function returns the array of initial values of state variables, 
+        with new_inits dictionary {name: value} applied.
+        '''
+        y0 = self.inits.copy()
+        if new_inits:
+            for (n, v) in new_inits.items():
+                y0[self.varIndex(n)] = v
+        return y0
+
+    def parIndex(self, name):
+        '''
+        Function returns the position of parameter name in the values list.
+        '''
+        i = self.__index.get(name.lower())
+        if i == None:
+            raise ValueError('No such parameter: '+name)
+        return i
+
+    def varIndex(self, name):
+        '''
+        Function returns the position of state variable name.
+        '''
+        i = self.__vindex.get(name.lower())
+        if i == None:
+            raise ValueError('No such state variable: '+name)
+        return i
+
+    def splitOverrides(self, overrides):
+        '''
+        Function splits overrides dictionary {name: value} into parameters,
+        initial conditions and options dictionaries (names are matched 
+        case insensitively). ValueError is raised for names which are 
+        neither parameters nor state variables nor options.
+        '''
+        ret = ({}, {}, {})
+        for (n, v) in (overrides or {}).items():
+            l = n.lower()
+            if l in self.__index:
+                ret[0][n] = v
+            elif l in self.__vindex:
+                ret[1][n] = v
+            elif l in self.options:
+                ret[2][l] = v
+            else:
+                raise ValueError('No such parameter, initial condition or option: '+n)
+        return ret
+
+# Cache of compiled systems: absolute path -> (file stamp, system)
+_systems = {}
+_systems_lock = threading.Lock()
+
+def compileOde(ode_file):
+    '''
+    Function returns OdeSystem of ode_file; systems are cached and 
+    recompiled only if the file has changed.
+    '''
+    path = os.path.abspath(ode_file)
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    with _systems_lock:
+        c = _systems.get(path)
+    if c != None and c[0] == stamp:
+        return c[1]
+    system = OdeSystem(path)
+    with _systems_lock:
+        _systems[path] = (stamp, system)
+    return system
@@ -0,0 +1,196 @@
+'''
+This file is part of XPPy.
+
+Copyright (c) 2009-2011, Jakub Nowacki
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the XPPy Developers nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+import re
+
+# Constants known to XPP
+INBUILT = {'pi': 3.14159265359}
+
+_name_re = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+_unhandled = ['global', 'table', 'wiener', 'markov', 'volt', 'special', 
+              'set', 'only', 'export', 'bdry', 'bndry', 'solv']
+_assign_re = re.compile(r'([A-Za-z_][A-Za-z0-9_]*)\s*=\s*([^,\s]+)')
+
+def closingBracket(expr, open_bracket):
+    '''
+    Function returns the index of the bracket closing the one at 
+    open_bracket in expr.
+    '''
+    depth = 0
+    for i in range(open_bracket+1, len(expr)):
+        if expr[i] == '(':
+            depth += 1
+        elif expr[i] == ')':
+            if depth == 0:
+                return i
+            depth -= 1
+    raise ValueError('Unbalanced brackets: '+expr)
+
+def splitIfThenElse(expr):
+    '''
+    Function splits expression if(condition)then(value)else(value) into
+    a dictionary {'condition', 'value_true', 'value_false'}.
+    '''
+    expr = expr.replace(' ', '')
+    cond_end = closingBracket(expr, 2)
+    true_start = cond_end+5
+    true_end = closingBracket(expr, true_start)
+    false_start = true_end+5
+    false_end = closingBracket(expr, false_start)
+    if expr[:3] != 'if(' or expr[cond_end+1:true_start] != 'then' or \
+       expr[true_end+1:false_start] != 'else' or false_end != len(expr)-1:
+        raise ValueError('Not an if(...)then(...)else(...) expression: '+expr)
+    return {'condition': expr[3:cond_end], 
+            'value_true': expr[true_start+1:true_end],
+            'value_false': expr[false_start+1:false_end]}
+
+def _assignments(text):
+    '''
+    Function returns the list of (name, value) pairs of a declaration 
+    line, e.g. 'a=1, b = 2 c=3'.
+    '''
+    return _assign_re.findall(re.sub(r'\s*=\s*', '=', text))
+
+def _lines(file_path):
+    '''
+    Function returns the lines of an ode file with the continuation lines
+    (ending with '\\') joined.
+    '''
+    f = open(file_path, 'r')
+    lines = []
+    cont = ''
+    for line in f:
+        line = line.strip()
+        if line.endswith('\\'):
+            cont += line[:-1]
+            continue
+        lines.append(cont+line)
+        cont = ''
+    f.close()
+    if cont != '':
+        lines.append(cont)
+    return lines
+
+def parseScript(file_path):
+    '''
+    Function parses an ode file into a dictionary of its parts: comments,
+    parameters, functions {name: {'arguments', 'value'}}, derived variables
+    (conditional ones, if(...)then(...)else(...), are kept separately as
+    dictionaries, see splitIfThenElse), time derivatives, auxiliary 
+    variables, initial values, settings (options, with lower case names) 
+    and unhandled lines. Expressions are kept as strings, the dictionaries
+    follow the order of declarations.
+    '''
+    data = {
+        'comments': [],
+        'parameters': dict(INBUILT),
+        'functions': {},
+        'derived_variables': {},
+        'conditional_derived_variables': {},
+        'time_derivatives': {},
+        'auxiliary_variables': {},
+        'initial_values': {},
+        'settings': {},
+        'unhandled': []
+    }
+
+    for line in _lines(file_path):
+        if len(line) == 0:
+            continue
+        # Comments
+        if line[0] == '#':
+            c = line[1:].strip()
+            if len(c) > 0:
+                data['comments'].append(c)
+            continue
+        if line.find('#') > 0:
+            line = line[:line.find('#')].strip()
+        word = line.split(None, 1)[0].lower()
+        rest = line[len(word):].strip()
+
+        # Parameter declarations
+        if word in ('number', 'p', 'par', 'param', 'parameter'):
+            for (k, v) in _assignments(rest):
+                data['parameters'][k] = float(v)
+        # Initial values declarations
+        elif word in ('i', 'init'):
+            for (k, v) in _assignments(rest):
+                data['initial_values'][k] = float(v)
+        # Auxiliary variables
+        elif word in ('a', 'aux'):
+            (k, v) = rest.split('=', 1)
+            data['auxiliary_variables'][k.strip()] = v.strip()
+        # Settings
+        elif line[0] == '@':
+            for (k, v) in _assignments(line[1:]):
+                data['settings'][k.lower()] = v
+        elif word == 'done':
+            break
+        # Declarations not covered here
+        elif word in _unhandled:
+            data['unhandled'].append(line)
+        # Derived parameters, computed from the others
+        elif line[0] == '!' and '=' in line:
+            (k, v) = line[1:].split('=', 1)
+            data['derived_variables'][k.strip()] = v.strip()
+        # Equations
+        elif '=' in line and re.match(r'[A-Za-z_]', line):
+            (key, value) = line.split('=', 1)
+            key = key.replace(' ', '')
+            value = value.strip()
+            if key.endswith("'"):
+                data['time_derivatives'][key[:-1]] = value
+            elif key.startswith('d') and key.endswith('/dt'):
+                data['time_derivatives'][key[1:-3]] = value
+            elif key.endswith('(t+1)'):
+                data['unhandled'].append(line)
+            elif key.endswith('[0]') or key.endswith('(0)'):
+                data['initial_values'][key[:-3]] = float(value)
+            elif '(' in key:
+                m = _name_re.match(key)
+                args = key[key.find('(')+1:key.rfind(')')].split(',')
+                if m.group(0) != key[:key.find('(')] or key[-1] != ')':
+                    data['unhandled'].append(line)
+                else:
+                    data['functions'][m.group(0)] = {'arguments': args,
+                                                     'value': value}
+            elif _name_re.match(key) and _name_re.match(key).group(0) == key:
+                if value.replace(' ', '').startswith('if('):
+                    try:
+                        data['conditional_derived_variables'][key] = \
+                            splitIfThenElse(value)
+                        continue
+                    except ValueError:
+                        pass
+                data['derived_variables'][key] = value
+            else:
+                data['unhandled'].append(line)
+        else:
+            data['unhandled'].append(line)
+
+    return data
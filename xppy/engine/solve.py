@@ -0,0 +1,296 @@
+'''
+This file is part of XPPy.
+
+Copyright (c) 2009-2011, Jakub Nowacki
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the XPPy Developers nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+import itertools
+import numpy as np #@UnresolvedImport
+from xppy.engine.model import compileOde
+from xppy.engine.cgen import compileC
+from xppy.utils.output import Output
+
+#####
+# Single steps of the fixed step methods
+#####
+def eulerStep(f, t, y, h, p):
+    return y+h*f(t, y, p)
+
+def heunStep(f, t, y, h, p):
+    k1 = f(t, y, p)
+    k2 = f(t+h, y+h*k1, p)
+    return y+0.5*h*(k1+k2)
+
+def rk4Step(f, t, y, h, p):
+    k1 = f(t, y, p)
+    k2 = f(t+0.5*h, y+0.5*h*k1, p)
+    k3 = f(t+0.5*h, y+0.5*h*k2, p)
+    k4 = f(t+h, y+h*k3, p)
+    return y+h/6.0*(k1+2.0*(k2+k3)+k4)
+
+# Dormand-Prince 5(4) tableau
+_dp_c = [0.0, 1/5, 3/10, 4/5, 8/9, 1.0, 1.0]
+_dp_a = [[],
+         [1/5],
+         [3/40, 9/40],
+         [44/45, -56/15, 32/9],
+         [19372/6561, -25360/2187, 64448/6561, -212/729],
+         [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+         [35/384, 0.0, 500/1113, 125/192, -2187/6784, 11/84]]
+# Difference of 5th and 4th order weights (error estimate)
+_dp_e = [71/57600, 0.0, -71/16695, 71/1920, -17253/339200, 22/525, -1/40]
+
+def _dopri(f, t, y, k1, h, p):
+    '''
+    Function makes a Dormand-Prince step; returns the new state, its 
+    derivative (first stage of the next step) and the error estimate.
+    '''
+    k = [k1]
+    for i in range(1, 7):
+        yi = y
+        for (a, kj) in zip(_dp_a[i], k):
+            if a != 0.0:
+                yi = yi+(h*a)*kj
+        k.append(f(t+_dp_c[i]*h, yi, p))
+    err = h*sum([e*kj for (e, kj) in zip(_dp_e, k) if e != 0.0])
+    return (yi, k[6], err)
+
+# XPP methods (in order of matching abbreviations) and their 
+# integrators: fixed step ones by step function, adaptive ones by None
+methods = [('euler', eulerStep), ('modeuler', heunStep), 
+           ('rungekutta', rk4Step), ('adams', rk4Step), ('qualrk', None), 
+           ('5dp', None), ('83dp', None), ('stiff', None), ('gear', None), 
+           ('cvode', None), ('rosen', None), ('2rb', None)]
+
+def getMethod(meth):
+    '''
+    Function returns the integrator of XPP method meth (name or its 
+    abbreviation): the step function of fixed step methods or None for
+    adaptive ones. XPP methods without an equivalent are replaced by the
+    closest one (multistep by RK4, adaptive and stiff by Dormand-Prince).
+    '''
+    meth = str(meth).lower()
+    for (name, step) in methods:
+        if name.startswith(meth):
+            return step
+    raise ValueError('Integration method not supported by the engine: '+meth)
+
+def _outOfBounds(y, bound):
+    if bound != None and not np.all(np.abs(y) <= bound):
+        print('Warning! Variables out of bounds (%g), integration stopped.' % bound)
+        return True
+    return False
+
+# Fixed step methods of the C backend
+_fixed = [eulerStep, heunStep, rk4Step]
+
+def _backend(system, backend):
+    '''
+    Function returns the compiled library of system for backend 'c' or 
+    None for 'numpy' (or if the compilation is not possible).
+    '''
+    if backend == 'numpy':
+        return None
+    if backend != 'c':
+        raise ValueError('No such backend: '+str(backend))
+    lib = compileC(system)
+    if lib == None:
+        print('Warning! C backend not available, using NumPy.')
+    return lib
+
+def integrate(system, y0=None, p=None, opts=None, backend='numpy'):
+    '''
+    Function integrates OdeSystem system from initial state y0 with 
+    parameter values p (by default the ones from the ode file) and returns
+    arrays of stored times and states (one row per time point). opts is 
+    a dictionary of options applied on top of the ode file ones: total, dt,
+    t0, trans, njmp, meth, toler, atoler, dtmin, dtmax and bound, as in 
+    XPP. The states are stored every njmp steps of dt (for adaptive 
+    methods dt is the output interval) from trans on.
+    For an ensemble, y0 has shape (number of variables, N) and items of 
+    p are scalars or arrays of shape (N,); all trajectories are advanced
+    together (adaptive methods use a common step, integration stops when
+    any of them gets out of bounds).
+    backend selects the evaluation of the equations: 'numpy' (default) or
+    'c', the system compiled into a shared library (see compileC), which 
+    falls back to 'numpy' if it cannot be compiled.
+    '''
+    o = dict(system.options)
+    if opts:
+        o.update(dict([(k.lower(), v) for (k, v) in opts.items()]))
+    if y0 is None:
+        y0 = system.initial()
+    if p is None:
+        p = system.parameters()
+    (total, dt, t0, trans) = [float(o[k]) for k in ('total', 'dt', 't0', 'trans')]
+    njmp = max(int(float(o['njmp'])), 1)
+    bound = None if o['bound'] == None else float(o['bound'])
+    step = getMethod(o['meth'])
+    f = system.rhs
+    nsteps = int(round(total/dt))
+
+    y = np.array(y0, dtype=float)
+    ts = t0+dt*np.arange(0, nsteps+1, njmp)
+    ys = np.empty((len(ts),)+y.shape)
+    ys[0] = y
+    n = 1
+    lib = _backend(system, backend)
+    if lib != None:
+        P = lib.params(p, 1 if y.ndim == 1 else y.shape[1])
+        f = lambda t, y, p: lib.rhs(t, y, P)
+    if lib != None and step != None:
+        n = lib.fixed(_fixed.index(step), y, P, t0, dt, nsteps, njmp, bound, ys)
+        if n < 0:
+            n = -n
+            print('Warning! Variables out of bounds (%g), integration stopped.' % bound)
+    elif step != None:
+        for k in range(1, nsteps+1):
+            y = step(f, t0+(k-1)*dt, y, dt, p)
+            if k % njmp == 0:
+                if _outOfBounds(y, bound):
+                    break
+                ys[n] = y
+                n += 1
+    else:
+        (rtol, atol) = (float(o['toler']), float(o['atoler']))
+        (hmin, hmax) = (float(o['dtmin']), float(o['dtmax']))
+        t = t0
+        h = min(dt, hmax)
+        k1 = f(t, y, p)
+        for n in range(1, len(ts)):
+            while t < ts[n]:
+                last = t+h >= ts[n]
+                hs = ts[n]-t if last else h
+                (yn, kn, err) = _dopri(f, t, y, k1, hs, p)
+                scale = atol+rtol*np.maximum(np.abs(y), np.abs(yn))
+                e = np.max(np.abs(err)/scale)
+                if e <= 1.0 or hs <= hmin:
+                    (t, y, k1) = (ts[n] if last else t+hs, yn, kn)
+                # Standard step size control, limited growth and shrinkage
+                fac = 5.0 if e == 0.0 else min(5.0, max(0.2, 0.9*e**-0.2))
+                if not last or e > 1.0:
+                    h = min(max(hs*fac, hmin), hmax)
+            if _outOfBounds(y, bound):
+                break
+            ys[n] = y
+        else:
+            n = len(ts)
+    
+    keep = ts[:n] >= trans
+    return (ts[:n][keep], ys[:n][keep])
+
+def simulate(ode_file, overrides=None, backend='numpy'):
+    '''
+    Function integrates ode_file with the engine (without running xppaut)
+    and returns Output with the same columns as the xppaut output file: 
+    time, state variables and auxiliary variables. overrides is 
+    a dictionary {name: value} of parameters, initial conditions and 
+    options (see integrate) used instead of the ones in the file.
+    backend is passed to integrate.
+    '''
+    system = compileOde(ode_file)
+    (pars, inits, opts) = system.splitOverrides(overrides)
+    p = system.parameters(pars)
+    (t, y) = integrate(system, system.initial(inits), p, opts, backend)
+    cols = [t] + list(y.T)
+    for a in system.auxFun(t, y.T, p):
+        cols.append(np.broadcast_to(a, t.shape))
+    out = Output(load=False)
+    out.setRawData(np.column_stack(cols))
+    out.setDesc(dict(system.desc))
+    return out
+
+def _ensembleSize(values):
+    '''
+    Function returns the number of trajectories of an ensemble given by 
+    override values (scalars or 1-D arrays of equal length).
+    '''
+    shape = np.broadcast_shapes(*[np.shape(v) for v in values])
+    if len(shape) > 1:
+        raise ValueError('Ensemble values must be scalars or 1-D arrays')
+    return shape[0] if len(shape) == 1 else 1
+
+def simulateEnsemble(ode_file, overrides=None, stack=True, backend='numpy'):
+    '''
+    Function integrates an ensemble of N trajectories of ode_file in one
+    vectorized solve. overrides is a dictionary {name: value} as for 
+    simulate, but values of parameters and initial conditions can be 
+    arrays of shape (N,), one value per trajectory (options are common).
+    Returns an array of shape (N, time points, columns), with the columns
+    of the xppaut output file, or, if stack=False, the list of N Outputs.
+    backend is passed to integrate.
+    '''
+    system = compileOde(ode_file)
+    (pars, inits, opts) = system.splitOverrides(overrides)
+    n = _ensembleSize(list(pars.values())+list(inits.values()))
+    p = system.parameters(dict([(k, np.asarray(v, dtype=float)) 
+                                for (k, v) in pars.items()]))
+    y0 = np.repeat(system.initial()[:, None], n, axis=1)
+    for (k, v) in inits.items():
+        y0[system.varIndex(k)] = v
+    (t, y) = integrate(system, y0, p, opts, backend)
+    # Time points x trajectories arrays
+    shape = (len(t), n)
+    y = y.transpose(1, 0, 2)
+    cols = [np.broadcast_to(t[:, None], shape)] + list(y)
+    for a in system.auxFun(t[:, None], y, p):
+        cols.append(np.broadcast_to(a, shape))
+    data = np.stack(cols, axis=-1).transpose(1, 0, 2)
+    if stack:
+        return data
+    outs = []
+    for d in data:
+        out = Output(load=False)
+        out.setRawData(d)
+        out.setDesc(dict(system.desc))
+        outs.append(out)
+    return outs
+
+def gridOverrides(param_grid):
+    '''
+    Function converts param_grid into ensemble overrides {name: array}.
+    param_grid is either a dictionary {name: values}, expanded as 
+    a Cartesian product in the order of the keys (as in runSweep), or 
+    a list of dictionaries {name: value} with the same names.
+    '''
+    if isinstance(param_grid, dict):
+        names = list(param_grid.keys())
+        points = list(itertools.product(*[param_grid[k] for k in names]))
+    else:
+        names = list(param_grid[0].keys())
+        points = [[g[k] for k in names] for g in param_grid]
+    values = np.array(points, dtype=float).reshape(len(points), len(names))
+    return dict(zip(names, values.T))
+
+def simulateSweep(ode_file, param_grid, stack=False, backend='numpy'):
+    '''
+    Function simulates a parameter sweep of ode_file (see runSweep for 
+    param_grid) as one ensemble with the engine and returns the list of 
+    outputs in the grid order or, if stack=True (default False), a single
+    array of shape (number of points, rows, columns). backend is passed
+    to integrate.
+    '''
+    return simulateEnsemble(ode_file, gridOverrides(param_grid), stack, 
+                            backend)
@@ -1,4 +1,5 @@
 from xppy.parser.parse import *
 from xppy.parser.run import *
+from xppy.parser.cache import *
 
 #__all__ = ['ode', 'set', 'run']
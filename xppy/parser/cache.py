@@ -0,0 +1,187 @@
+'''
+This file is part of XPPy.
+
+Copyright (c) 2009-2011, Jakub Nowacki
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the XPPy Developers nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+import os
+import shutil
+import hashlib
+import numpy as np #@UnresolvedImport
+from xppy.utils.output import Output
+
+class ResultCache:
+    '''
+    Class implements an on-disk, content-addressed cache of simulation 
+    results. Entries are keyed by a hash of the ode and set files content,
+    parameter overrides and xppaut version; the least recently used entries
+    are evicted when the total size exceeds max_size bytes.
+    '''
+    def __init__(self, cache_dir, max_size=1024**3):
+        '''
+        Constructor
+        '''
+        self.dir = cache_dir
+        self.maxSize = max_size
+        self.hits = 0
+        self.misses = 0
+        if not os.path.exists(self.dir):
+            os.makedirs(self.dir)
+
+    def key(self, ode_file, set_file=None, xpp_cmd='xppaut', overrides=None,
+            version=None):
+        '''
+        Function returns the key of a simulation: a hash of ode_file and 
+        set_file content, overrides (a dictionary or any object with a stable
+        repr, e.g. a parameter list) and xppaut version. If version is not 
+        given, it is identified by the path, size and modification time of
+        the xppaut executable.
+        '''
+        h = hashlib.sha256()
+        for fn in [ode_file, set_file]:
+            if fn != None and os.path.exists(fn):
+                f = open(fn, 'rb')
+                h.update(f.read())
+                f.close()
+            h.update(b'\0')
+        if isinstance(overrides, dict):
+            # Order of the dictionary doesn't change the simulation
+            overrides = sorted(overrides.items())
+        if overrides != None:
+            h.update(repr(overrides).encode())
+        h.update(b'\0')
+        if version == None:
+            version = xppVersion(xpp_cmd)
+        h.update(str(version).encode())
+        return h.hexdigest()
+
+    def __path(self, key):
+        return os.path.join(self.dir, key+'.npy')
+
+    def get(self, key, ode_file=''):
+        '''
+        Function returns the cached Output for key (with descriptor read 
+        from ode_file) or None if there is no such entry.
+        '''
+        fn = self.__path(key)
+        try:
+            data = np.load(fn)
+        except (IOError, ValueError):
+            self.misses += 1
+            return None
+        # Mark the entry as recently used
+        os.utime(fn, None)
+        self.hits += 1
+        out = Output(ode_file, '')
+        out.setRawData(data)
+        return out
+
+    def put(self, key, out):
+        '''
+        Function stores the raw data of Output out under key and evicts 
+        the least recently used entries if the cache is too big.
+        '''
+        data = out.getRawData()
+        if data is None:
+            return False
+        fn = self.__path(key)
+        # Write to a temporary file first, so concurrent readers never
+        # see a partial entry
+        tmp = '%s.%i.tmp' % (fn, os.getpid())
+        f = open(tmp, 'wb')
+        np.save(f, data)
+        f.close()
+        os.replace(tmp, fn)
+        self.evict()
+        return True
+
+    def entries(self):
+        '''
+        Function returns the list of (access time, size, file name) of 
+        the cache entries, the least recently used first.
+        '''
+        ret = []
+        for n in os.listdir(self.dir):
+            if not n.endswith('.npy'):
+                continue
+            fn = os.path.join(self.dir, n)
+            try:
+                st = os.stat(fn)
+            except OSError:
+                continue
+            ret.append((st.st_mtime, st.st_size, fn))
+        return sorted(ret)
+
+    def size(self):
+        '''
+        Function returns the total size of the cache entries in bytes.
+        '''
+        return sum([e[1] for e in self.entries()])
+
+    def evict(self):
+        '''
+        Function removes the least recently used entries until the cache
+        size does not exceed maxSize.
+        '''
+        ent = self.entries()
+        tot = sum([e[1] for e in ent])
+        for (t, s, fn) in ent:
+            if tot <= self.maxSize:
+                break
+            try:
+                os.remove(fn)
+            except OSError:
+                pass
+            tot -= s
+
+    def clear(self):
+        '''
+        Function removes all the entries and resets the statistics.
+        '''
+        for (t, s, fn) in self.entries():
+            os.remove(fn)
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        '''
+        Function returns the cache statistics dictionary.
+        '''
+        ent = self.entries()
+        tot = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': float(self.hits)/tot if tot > 0 else 0.0,
+                'entries': len(ent), 'size': sum([e[1] for e in ent])}
+
+def xppVersion(xpp_cmd='xppaut'):
+    '''
+    Function returns a string identifying xppaut executable xpp_cmd 
+    (its path, size and modification time).
+    '''
+    path = shutil.which(xpp_cmd)
+    if path == None:
+        return str(xpp_cmd)
+    st = os.stat(path)
+    return '%s:%i:%i' % (path, st.st_size, int(st.st_mtime))
@@ -27,118 +27,245 @@ ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
 SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 '''
 import os
+import re
+import copy
+import threading
+import collections
 import numpy as np
 
 tmp_name = '__tmp__'
 tmp_ode  = tmp_name+'.ode'
 tmp_set  = tmp_name+'.set'
 
-def change_ode(ode_file=tmp_ode, new_pars=[]):
+class OdeModel:
     '''
-    Function changes the parameters and initial conditions specified in
-    new_pars in given ode_file. 
+    Class holds an ode file parsed in a single pass: the indexed tables
+    of parameters, initial conditions and options (with the positions of
+    their values in the file lines, so changes do not rescan the file) and
+    the variables descriptor. Use loadOdeModel to get a cached model.
     '''
-    print('Warning! Function is obsolete, use changeOde instead!')
-    changeOde(new_pars, ode_file)
+    def __init__(self, ode_file=tmp_ode):
+        '''
+        Constructor
+        '''
+        # If file doesn't exist, Python throws exception by itself
+        f = open(ode_file, 'r')
+        self.lines = f.readlines()
+        f.close()
+        self.file = ode_file
+        # Entries are [type, name, value, line, value start, value end]
+        self.entries = []
+        self.index = {}    # (type, name) -> number of the first entry
+        self.lineEntries = {} # line -> numbers of its entries
+        for (n, line) in enumerate(self.lines):
+            tp = _lineType(line)
+            if tp != None:
+                self.__parseLine(n, line, tp)
+        (self.desc, nv) = _odeVars(self.lines)
+        # State variables and their initial values (declared in init lines
+        # or as name(0)=value; XPP uses 0 for undeclared ones)
+        self.vars = [self.desc[i] for i in range(1, nv+1)]
+        self.inits = dict([(v.lower(), '0') for v in self.vars])
+        for line in self.lines:
+            m = _init_re.match(line)
+            if m != None:
+                self.inits[m.group(1).lower()] = m.group(2).strip()
+        for e in self.entries:
+            if e[0] == 'init':
+                self.inits[e[1].lower()] = e[2]
 
-def changeOde(new_pars, ode_file=tmp_ode):
+    def __parseLine(self, n, line, tp):
+        '''
+        Parses the entries of parameter, initial condition or option line.
+        '''
+        pos = line.find(' ')+1
+        for seg in line[pos:].split(','):
+            i = seg.find('=')
+            if i >= 0:
+                # Value ends before trailing spaces and the end of line
+                end = pos+len(seg.rstrip())
+                e = [tp, seg[:i].strip(), seg[i+1:].strip(), n, pos+i+1, end]
+                self.__entry(e)
+            pos += len(seg)+1
+
+    def __entry(self, e):
+        k = len(self.entries)
+        self.entries.append(e)
+        self.index.setdefault((e[0], e[1]), k)
+        self.lineEntries.setdefault(e[3], []).append(k)
+
+    def getPars(self, read_par=True, read_init=True, read_opt=True):
+        '''
+        Function returns parameters list (as readOdePars).
+        '''
+        tps = []
+        if read_par: tps.append('par')
+        if read_init: tps.append('init')
+        if read_opt: tps.append('@')
+        return [e[:3] for e in self.entries if e[0] in tps]
+
+    def splitOverrides(self, overrides):
+        '''
+        Function splits overrides dictionary {name: value} into parameters,
+        initial conditions and options dictionaries (names are matched 
+        case insensitively, as in XPP). ValueError is raised for names 
+        which are neither parameters nor state variables nor options.
+        '''
+        pars = dict([(e[1].lower(), e[1]) for e in self.entries if e[0] == 'par'])
+        opts = dict([(e[1].lower(), e[1]) for e in self.entries if e[0] == '@'])
+        ret = ({}, {}, {})
+        for (n, v) in overrides.items():
+            l = n.lower()
+            if l in pars:
+                ret[0][pars[l]] = v
+            elif l in self.inits:
+                ret[1][l] = v
+            elif l in opts:
+                ret[2][opts[l]] = v
+            elif l in _xpp_opts:
+                ret[2][n] = v
+            else:
+                raise ValueError('No such parameter, initial condition or option: '+n)
+        return ret
+
+    def getValue(self, name, tp='par'):
+        '''
+        Function returns the value (string) of the parameter, initial 
+        condition or option name, or None if it doesn't exist.
+        '''
+        k = self.index.get((tp, name))
+        if k == None:
+            return None
+        return self.entries[k][2]
+
+    def setValues(self, new_pars):
+        '''
+        Function changes the parameters, initial conditions and options 
+        specified in new_pars in the lines of the model (the file is not 
+        written, see write). Returns the number of changed values.
+        '''
+        pars = list(new_pars)
+        if len(pars) == 0:
+            return 0
+        # Check if the pars is a single list or list of lists
+        if type(pars[0]) is not list:
+            pars = [pars]
+        nc = 0
+        for p in pars:
+            k = self.index.get((p[0], p[1]))
+            if k == None: # Parameter doesn't exist
+                continue
+            e = self.entries[k]
+            v = str(p[2])
+            line = self.lines[e[3]]
+            self.lines[e[3]] = line[:e[4]]+v+line[e[5]:]
+            # Move the values following on the same line
+            d = len(v)-(e[5]-e[4])
+            for j in self.lineEntries[e[3]]:
+                if self.entries[j][4] > e[4]:
+                    self.entries[j][4] += d
+                    self.entries[j][5] += d
+            e[2] = v; e[5] += d
+            if e[0] == 'init':
+                self.inits[e[1].lower()] = v
+            nc += 1
+        return nc
+
+    def text(self):
+        '''
+        Function returns the text of the model.
+        '''
+        return ''.join(self.lines)
+
+    def write(self, ode_file=None):
+        '''
+        Function writes the model to ode_file (by default to the file it
+        was read from, then the cached model stays valid).
+        '''
+        if ode_file == None:
+            ode_file = self.file
+        f = open(ode_file, 'w')
+        f.writelines(self.lines)
+        f.close()
+        if os.path.abspath(ode_file) == os.path.abspath(self.file):
+            _cacheModel(self)
+
+# Initial value given as name(0)=value or name[0]=value
+_init_re = re.compile(r'^\s*(\w+)\s*[\(\[]\s*0\s*[\)\]]\s*=(.*)$')
+# XPP numerical and plotting options (lower case) which can be set even if 
+# they are not declared in the ode file
+_xpp_opts = ['total', 'dt', 'njmp', 'maxstor', 't0', 'trans', 'meth', 
+             'dtmin', 'dtmax', 'toler', 'atoler', 'bound', 'delay', 'nout',
+             'seed', 'bandup', 'bandlo', 'jac_eps', 'newt_tol', 'newt_iter',
+             'output']
+
+# Cache of parsed models: absolute path -> (file stamp, model), the least
+# recently used models are dropped when there are more than model_cache_size
+model_cache_size = 64
+_models = collections.OrderedDict()
+_models_lock = threading.Lock()
+
+def _stamp(ode_file):
+    st = os.stat(ode_file)
+    return (st.st_mtime_ns, st.st_size)
+
+def _cacheModel(model):
+    path = os.path.abspath(model.file)
+    with _models_lock:
+        _models[path] = (_stamp(path), model)
+        _models.move_to_end(path)
+        while len(_models) > model_cache_size:
+            _models.popitem(last=False)
+
+def forgetOdeModels(path):
     '''
-    Function changes the parameters, initial conditions and options specified in
-    new_pars in given ode_file. 
+    Function drops the cached models (see loadOdeModel) of the ode file 
+    path or of all the files in the directory path.
     '''
-    # Copy the new_pars list
-    pars = list(new_pars)
-    # Check if the pars is a single list or list of lists
-    if type(pars[0]) is not list:
-        pars = [pars] # Make list of lists (for for loop below)
-    # Reading the file
-    # If file doesn't exist, Python throws exception by itself
-    f = open(ode_file, 'r')
-    lines = f.readlines()
-    f.close()
-    
-    for line in list(lines):
-        # Check the type of the current line
-        if line.find('par') == 0 or line.find('p ') == 0:
-            tp = 'par'
-        elif line.find('init') == 0 or line.find('i ') == 0:
-            tp = 'init'
-        elif line.find('@ ') == 0:
-            tp = '@'
-        # If it's not par, init or opt read next line
-        else:
-            continue
-        
-        # Go through the parameter array    
-        for p in list(pars): 
-            # Check only if the type of parameter matches the type of the line
-            if p[0] == tp:
-                i = line.find(p[1]+'=') # Find exact name followed by =
-                if i == -1: # Parameter doesn't exist
-                    continue
-                t1 = line[:i+len(p[1])+1] # Read string up to =
-                t2 = line[i+len(p[1])+1:] # Read string after =
-                t2 = t2[t2.find(','):]    # Get rid of the old value
-                # Adding the new line
-                lines[lines.index(line)] = t1+str(p[2])+t2
-                line = t1+str(p[2])+t2
-                pars.pop(pars.index(p)) # Delete the changed parameter
-    
-    # Write file with new lines                    
-    f = open(ode_file, 'w')
-    f.writelines(lines)
-    f.close()
-            
-def readOdePars(ode_file=tmp_ode, read_par=True, read_init=True, read_opt=True):
+    path = os.path.abspath(path)
+    with _models_lock:
+        for p in list(_models.keys()):
+            if p == path or p.startswith(os.path.join(path, '')):
+                del _models[p]
+
+def loadOdeModel(ode_file=tmp_ode):
     '''
-    Function reads the parameters and initial conditions  and options 
-    from ode_file and returns parameters list. By default all the values 
-    are read; the read of a specific type can be suppressed by changing
-    the appropriate flag to False.
+    Function returns parsed OdeModel of ode_file; the model is cached and
+    parsed again only if the file modification time or size changed; at
+    most model_cache_size models are kept. Changes of the returned (shared)
+    model should be made on its copy and written with its write method.
     '''
-    # Reading the file
-    # If file doesn't exist, Python throws exception by itself
-    f = open(ode_file, 'r')
-    lines = f.readlines()
-    f.close()
-    
-    pars = []
-    for line in list(lines):
-        # Check the type of the current line
-        if read_par and (line.find('par') == 0 or line.find('p ') == 0):
-            type = 'par'
-        elif read_init and (line.find('init') == 0 or line.find('i ') == 0):
-            type = 'init'
-        elif read_opt and line.find('@ ') == 0:
-            type = '@'
-        # If it's not par or init read next line
-        else:
-            continue
-        
-        # For each parameter or initial condition
-        for s in line[line.find(' ')+1:].split(','):
-            s = s.strip()    # Get rid of spaces
-            v = s.split('=') 
-            # Save type, name and value
-            pars.append([type, v[0], v[1]])
-            
-    return pars
+    path = os.path.abspath(ode_file)
+    with _models_lock:
+        c = _models.get(path)
+        if c != None:
+            _models.move_to_end(path)
+    if c != None and c[0] == _stamp(path):
+        return c[1]
+    model = OdeModel(ode_file)
+    _cacheModel(model)
+    return model
 
-def readOdeVars(ode_file=tmp_ode):
+def _lineType(line):
     '''
-    Function reads the variables names from ode_file (including auxiliary 
-    variables) and returns a data descriptor dictionary; the numbers represent
-    columns in the output.dat file.
+    Function returns the type of ode file line: 'par', 'init', '@' or None.
+    '''
+    if line.find('par') == 0 or line.find('p ') == 0:
+        return 'par'
+    elif line.find('init') == 0 or line.find('i ') == 0:
+        return 'init'
+    elif line.find('@ ') == 0:
+        return '@'
+    return None
+
+def _odeVars(lines):
+    '''
+    Function returns the variables descriptor of ode file lines and the 
+    number of the state variables.
     '''
-    # Reading the file
-    # If file doesn't exist, Python throws exception by itself
-    f = open(ode_file, 'r')
-    lines = f.readlines()
-    f.close()
-    
     desc = [['time', 0], ['t', 0], [0, 'time']]; i = 1
     # First read equations
-    for line in list(lines):
+    for line in lines:
         # Check the type of the current line
         # skip comments
         if line.find('#') == 0:
@@ -156,8 +283,9 @@ def readOdeVars(ode_file=tmp_ode):
             desc.append([n,i]); desc.append([i,n]); i += 1
         else:
             continue
+    nv = i-1
     # Auxiliary vars are later in data file, so need second run
-    for line in list(lines):
+    for line in lines:
         # Check the type of the current line
         # skip comments
         if line.find('#') == 0:
@@ -169,7 +297,250 @@ def readOdeVars(ode_file=tmp_ode):
         else:
             continue
     
-    return dict(desc)
+    return (dict(desc), nv)
+
+def _parsList(new_pars):
+    '''
+    Function returns new_pars as a list of [type, name, value] lists;
+    new_pars can be a single parameter list, a list of them or 
+    a dictionary {name: value} (then the type is None, i.e. any).
+    '''
+    if isinstance(new_pars, dict):
+        return [[None, n, v] for (n, v) in new_pars.items()]
+    pars = list(new_pars)
+    if len(pars) > 0 and type(pars[0]) is not list:
+        pars = [pars]
+    return pars
+
+class _Template:
+    '''
+    Base class of file templates: the text is kept as constant chunks 
+    interleaved with value slots.
+    '''
+    def __init__(self):
+        self.newline = None # newline translation used to write the file
+        self.parts = []  # chunk, slot, chunk, ..., slot, chunk
+        self.slots = {}  # (type, name) -> number of the slot
+        self.names = {}  # name -> number of the slot (first of any type)
+
+    def _addSlot(self, tp, name, value):
+        k = len(self.parts)//2
+        self.parts.append(value)
+        self.slots.setdefault((tp, name), k)
+        self.names.setdefault(name, k)
+    
+    def _format(self, k, value):
+        return str(value)
+
+    def slot(self, tp, name):
+        '''
+        Function returns the number of the slot of the given type and name
+        (any type if tp is None), or None if there is no such slot.
+        '''
+        if tp == None:
+            return self.names.get(name)
+        return self.slots.get((tp, name))
+
+    def render(self, new_pars=[]):
+        '''
+        Function returns the text with parameters, initial conditions and 
+        options given in new_pars (a parameter list, list of them or 
+        a dictionary {name: value}) filled in; the other values stay 
+        unchanged. The cost is linear in the size of the text.
+        '''
+        parts = list(self.parts)
+        for p in _parsList(new_pars):
+            k = self.slot(p[0], p[1])
+            if k != None:
+                parts[2*k+1] = self._format(k, p[2])
+        return ''.join(parts)
+
+    def write(self, file_name, new_pars=[]):
+        '''
+        Function writes the rendered text (see render) to file_name.
+        '''
+        f = open(file_name, 'w', newline=self.newline)
+        f.write(self.render(new_pars))
+        f.close()
+
+class OdeTemplate(_Template):
+    '''
+    Class holds an ode file parsed once into a template with a slot for 
+    the value of every parameter, initial condition and option; variants
+    of the file are rendered by filling the slots (see render).
+    '''
+    def __init__(self, ode_file=tmp_ode):
+        '''
+        Constructor
+        '''
+        _Template.__init__(self)
+        model = loadOdeModel(ode_file)
+        ent = sorted(model.entries, key=lambda e: (e[3], e[4]))
+        text = model.text()
+        # Offsets of the lines in the text
+        lpos = [0]
+        for l in model.lines:
+            lpos.append(lpos[-1]+len(l))
+        last = 0
+        for e in ent:
+            b = lpos[e[3]]+e[4]
+            self.parts.append(text[last:b])
+            self._addSlot(e[0], e[1], e[2])
+            last = lpos[e[3]]+e[5]
+        self.parts.append(text[last:])
+
+class SetTemplate(_Template):
+    '''
+    Class holds a set file parsed once into a template with a slot for
+    every parameter and initial condition line; variants of the file are
+    rendered by filling the slots (see render). Names are matched case 
+    insensitively, as in XPP.
+    '''
+    def __init__(self, set_file=tmp_set):
+        '''
+        Constructor
+        '''
+        _Template.__init__(self)
+        # Line separators are kept as they are in the file
+        self.newline = ''
+        # If file doesn't exist, Python throws exception by itself
+        f = open(set_file, 'r', newline='')
+        lines = f.readlines()
+        f.close()
+        self.__line_names = []
+        chunk = ''; tp = None
+        for line in lines:
+            # Check the type of the current line
+            if line.find('# Parameters') == 0 and tp !='par':
+                tp = 'par'
+            elif line.find('# Old ICs') == 0 and tp != 'init':
+                tp = 'init'
+            # If it's not par or init read next line
+            elif line.find('#') == 0 and (tp == 'par' or tp == 'init'): 
+                tp = None
+            elif (tp == 'par' or tp == 'init') and len(line.split()) == 2:
+                # The whole line is a slot, value and name are separated
+                # by a space
+                self.parts.append(chunk); chunk = ''
+                n = line.split()[1]
+                body = line.rstrip('\r\n')
+                self.__line_names.append((n, line[len(body):]))
+                self._addSlot(tp, n.lower(), line)
+                continue
+            chunk += line
+        self.parts.append(chunk)
+
+    def slot(self, tp, name):
+        return _Template.slot(self, tp, name.lower())
+
+    def _format(self, k, value):
+        (n, linesep) = self.__line_names[k]
+        return str(value)+'  '+n+linesep
+
+def _setValues(set_file, tp):
+    '''
+    Function returns the values of the given type from set_file as 
+    a dictionary with lower case names.
+    '''
+    if set_file == None or not os.path.exists(set_file):
+        return {}
+    return dict([(p[1].lower(), p[2]) for p in readSetPars(set_file) 
+                 if p[0] == tp])
+
+def writeParFile(par_file, new_pars, ode_file=tmp_ode, set_file=None):
+    '''
+    Function writes XPP parameter file (as read by xppaut -parfile) with 
+    all the parameters of ode_file, in the order of declaration; values 
+    are taken from new_pars dictionary {name: value}, then set_file (if
+    given) and the ode file.
+    '''
+    model = loadOdeModel(ode_file)
+    new = dict([(n.lower(), v) for (n, v) in new_pars.items()])
+    base = _setValues(set_file, 'par')
+    pars = []; seen = set()
+    for e in model.entries:
+        l = e[1].lower()
+        if e[0] != 'par' or l in seen:
+            continue
+        seen.add(l)
+        pars.append('%s %s\n' % (new.get(l, base.get(l, e[2])), e[1]))
+    f = open(par_file, 'w')
+    f.write('%i Number params\n' % (len(pars),))
+    f.writelines(pars)
+    f.close()
+
+def writeIcFile(ic_file, new_inits, ode_file=tmp_ode, set_file=None):
+    '''
+    Function writes XPP initial conditions file (as read by xppaut -icfile)
+    with one value per state variable of ode_file; values are taken from 
+    new_inits dictionary {name: value}, then set_file (if given) and 
+    the ode file.
+    '''
+    model = loadOdeModel(ode_file)
+    new = dict([(n.lower(), v) for (n, v) in new_inits.items()])
+    base = _setValues(set_file, 'init')
+    f = open(ic_file, 'w')
+    for v in model.vars:
+        l = v.lower()
+        f.write('%s\n' % (new.get(l, base.get(l, model.inits[l])),))
+    f.close()
+
+def renderOptions(new_opts, ode_file=tmp_ode):
+    '''
+    Function returns the text of ode_file with options given in new_opts
+    dictionary {name: value} changed; options not declared in the file are
+    added before the 'done' line.
+    '''
+    model = loadOdeModel(ode_file)
+    opts = dict([(e[1].lower(), e[1]) for e in model.entries if e[0] == '@'])
+    found = {}; extra = ''
+    for (n, v) in new_opts.items():
+        if n.lower() in opts:
+            found[opts[n.lower()]] = v
+        else:
+            extra += '@ %s=%s\n' % (n, v)
+    lines = OdeTemplate(ode_file).render([['@', n, v] for (n, v) in found.items()])
+    lines = lines.splitlines(True)
+    i = len(lines)
+    for (k, l) in enumerate(lines):
+        if l.strip() == 'done':
+            i = k
+    return ''.join(lines[:i])+extra+''.join(lines[i:])
+
+def change_ode(ode_file=tmp_ode, new_pars=[]):
+    '''
+    Function changes the parameters and initial conditions specified in
+    new_pars in given ode_file. 
+    '''
+    print('Warning! Function is obsolete, use changeOde instead!')
+    changeOde(new_pars, ode_file)
+
+def changeOde(new_pars, ode_file=tmp_ode):
+    '''
+    Function changes the parameters, initial conditions and options specified in
+    new_pars in given ode_file. 
+    '''
+    # The cached model is replaced only if the file is written
+    model = copy.deepcopy(loadOdeModel(ode_file))
+    model.setValues(new_pars)
+    model.write()
+            
+def readOdePars(ode_file=tmp_ode, read_par=True, read_init=True, read_opt=True):
+    '''
+    Function reads the parameters and initial conditions  and options 
+    from ode_file and returns parameters list. By default all the values 
+    are read; the read of a specific type can be suppressed by changing
+    the appropriate flag to False.
+    '''
+    return loadOdeModel(ode_file).getPars(read_par, read_init, read_opt)
+
+def readOdeVars(ode_file=tmp_ode):
+    '''
+    Function reads the variables names from ode_file (including auxiliary 
+    variables) and returns a data descriptor dictionary; the numbers represent
+    columns in the output.dat file.
+    '''
+    return dict(loadOdeModel(ode_file).desc)
 
 
 def change_set(set_file, new_pars):
@@ -183,62 +554,9 @@ def change_set(set_file, new_pars):
 def changeSet(new_pars, set_file=tmp_set):
     '''
     Function changes the parameters and initial conditions specified in
-    new_pars in given ode_file. 
+    new_pars in given set_file. 
     '''
-    # Copy the new_pars list
-    pars = list(new_pars)
-    # Check if the pars is a single list or list of lists
-    if type(pars[0]) is not list:
-        pars = [pars] # Make list of lists (for for loop below)
-    # Reading the file
-    # If file doesn't exist, Python throws exception by itself
-    f = open(set_file, 'r')
-    lines = f.readlines()
-    f.close()
-    
-    # Check type
-    tp = None
-    # Check line separator for the file
-    if lines[0][-2:] == '\r\n':
-        linesep = '\r\n' # Windows
-    else:
-        linesep = '\n' # *nix
-    for line in list(lines): 
-        # Check the type of the current line
-        if line.find('# Parameters') == 0 and tp !='par':
-            tp = 'par'
-            continue
-        elif line.find('# Old ICs') == 0 and tp != 'init':
-            tp = 'init'
-            continue
-        # If it's not par or init read next line
-        elif line.find('#') == 0 and (tp == 'par' or tp == 'init'): 
-            tp = None
-            continue
-        
-        if tp != 'par' and tp != 'init':
-            continue     
-        
-        # Go through the parameter array    
-        for p in list(pars): 
-            # Check only if the type of parameter matches the type of the line
-            if p[0] == tp:
-                i = line.find(p[1]+linesep) # Find exact name
-                if i == -1: # May be upper case?
-                    tmp = p[1].upper()
-                    i = line.find(tmp)
-                    if i == -1: # Parameter doesn't exist
-                        continue
-                    p[1] = tmp
-                # Adding the new line
-                lines[lines.index(line)] = str(p[2])+'  '+p[1]+linesep   
-                line = str(p[2])+'  '+p[1]+linesep  
-                pars.pop(pars.index(p)) # Delete the changed parameter
-    
-    # Write file with new lines                    
-    f = open(set_file, 'w')
-    f.writelines(lines)
-    f.close()
+    SetTemplate(set_file).write(set_file, new_pars)
     
 def readSetPars(set_file=tmp_set, read_par=True, read_init=True):
     '''
@@ -27,13 +27,23 @@ ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
 SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 '''
 import os
+import asyncio
 import shutil
+import subprocess
+import tempfile
+import time
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np #@UnresolvedImport
 from xppy.parser import parse
-from xppy.utils.output import Output
+from xppy.utils.output import Output, sidecarFiles
 
 tmp_name = '__tmp__'
 tmp_ode  = tmp_name+'.ode'
 tmp_set  = tmp_name+'.set'
+tmp_par  = tmp_name+'.par'
+tmp_ic   = tmp_name+'.ic'
+tmp_opt  = tmp_name+'_opt.ode'
 c_g = 'xppaut'
 
 def set_cmd(xpp_path):
@@ -42,36 +52,215 @@ def set_cmd(xpp_path):
     print("XPP Path set: %s" % (c_g,))
     return c_g
 
-def run(ode_file=tmp_ode, set_file=tmp_set, verbose=False):
+class RunContext:
+    '''
+    Class holds the state of a single simulation session: a private working 
+    directory with the copies of ode and set files, the xppaut command and
+    the location of the output file. Runs using different contexts do not 
+    share any files, so they can be executed concurrently (in threads or 
+    processes) without changing the current directory.
+    '''
+    def __init__(self, ode_file=None, set_file=None, xpp_cmd=None, dir=None):
+        '''
+        Constructor; creates a unique working directory (in dir, by default 
+        in the system temporary directory) and, if given, copies ode_file 
+        and set_file into it.
+        '''
+        self.dir = tempfile.mkdtemp(prefix=tmp_name, dir=dir)
+        self.ode_file = os.path.join(self.dir, tmp_ode)
+        self.set_file = os.path.join(self.dir, tmp_set)
+        self.output_file = os.path.join(self.dir, 'output.dat')
+        if xpp_cmd == None:
+            xpp_cmd = c_g
+        self.xpp_cmd = xpp_cmd
+        if ode_file != None or set_file != None:
+            createTmp(ode_file, set_file, self)
+
+    def close(self):
+        '''
+        Removes the working directory with all its content.
+        '''
+        if os.path.exists(self.dir):
+            shutil.rmtree(self.dir, ignore_errors=True)
+        parse.forgetOdeModels(self.dir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+def _resolve(context, ode_file=tmp_ode, set_file=tmp_set):
+    '''
+    Function returns ode file, set file, output file, xppaut command and 
+    working directory to be used, for the given context (None means the 
+    global, current directory based, setup).
+    '''
+    if context == None:
+        return (ode_file, set_file, 'output.dat', c_g, None)
+    if ode_file == tmp_ode:
+        ode_file = context.ode_file
+    if set_file == tmp_set:
+        set_file = context.set_file
+    return (os.path.abspath(ode_file), os.path.abspath(set_file), 
+            context.output_file, context.xpp_cmd, context.dir)
+
+class RunResult:
+    '''
+    Class stores the outcome of a single xppaut process: the command, the
+    exit status, the wall time (in seconds), the captured xppaut log and 
+    the output of the simulation (None if the run was killed).
+    '''
+    def __init__(self, args=None, returnCode=None, duration=0.0, log='',
+                 timedOut=False, output=None):
+        '''
+        Constructor
+        '''
+        self.args = args
+        self.returnCode = returnCode
+        self.duration = duration
+        self.log = log
+        self.timedOut = timedOut
+        self.output = output
+
+    def __str__(self):
+        ret = 'Command: %s\nExit status: %s, duration: %.3f s' % \
+              (' '.join(self.args), self.returnCode, self.duration)
+        if self.timedOut:
+            ret += ' (killed after timeout)'
+        return ret
+
+def _removeOutput(out_file):
+    '''
+    Function removes the output file and its binary sidecar files.
+    '''
+    for fn in (out_file,)+sidecarFiles(out_file):
+        if os.path.exists(fn):
+            os.remove(fn)
+
+def _command(cmd, ode_file, set_file, overrides=None, cwd=None):
+    '''
+    Function returns xppaut argument list for the given files. Overrides
+    of parameters and initial conditions are passed in generated parameter
+    and initial conditions files (in cwd, by default the current directory);
+    overrides of options need a private copy of the ode file.
+    '''
+    if overrides:
+        if cwd == None:
+            cwd = os.getcwd()
+        s_file = set_file if os.path.exists(set_file) else None
+        (pars, inits, opts) = parse.loadOdeModel(ode_file).splitOverrides(overrides)
+        if len(opts) > 0:
+            text = parse.renderOptions(opts, ode_file)
+            ode_file = os.path.join(cwd, tmp_opt)
+            f = open(ode_file, 'w')
+            f.write(text)
+            f.close()
+    args = [str(cmd), ode_file, '-silent']
+    if os.path.exists(set_file):
+        args += ['-setfile', set_file]
+    if overrides:
+        if len(pars) > 0:
+            fn = os.path.join(cwd, tmp_par)
+            parse.writeParFile(fn, pars, ode_file, s_file)
+            args += ['-parfile', fn]
+        if len(inits) > 0:
+            fn = os.path.join(cwd, tmp_ic)
+            parse.writeIcFile(fn, inits, ode_file, s_file)
+            args += ['-icfile', fn]
+    return args
+
+def runProcess(ode_file=tmp_ode, set_file=tmp_set, timeout=None, 
+               verbose=False, context=None, overrides=None):
+    '''
+    Function runs xppaut with the given ode_file and, optionally, set_file
+    as a subprocess (no shell is involved) and returns RunResult. If the 
+    run takes longer than timeout seconds (default None, i.e. no limit), 
+    xppaut is killed and the result is marked as timed out. xppaut messages
+    are always captured in the result log; if verbose=True (default False) 
+    they are displayed as well.
+    If context (RunContext) is given, the simulation is run in its working
+    directory and, by default, uses its copies of ode and set files.
+    overrides is a dictionary {name: value} of parameters, initial 
+    conditions and options to be used instead of the ones in the files;
+    they are passed to xppaut in generated files, so ode_file and set_file
+    are not changed (and can be shared read-only).
+    '''
+    (ode_file, set_file, out_file, cmd, cwd) = _resolve(context, ode_file, set_file)
+    if not os.path.exists(ode_file):
+        raise IOError('No such file or directory: '+ode_file)
+    # Do not let a failed run return the data of the previous one
+    _removeOutput(out_file)
+
+    args = _command(cmd, ode_file, set_file, overrides, cwd)
+    res = RunResult(args)
+    t0 = time.monotonic()
+    # XPP writes output.dat into its working directory
+    p = subprocess.Popen(args, cwd=cwd, stdin=subprocess.DEVNULL,
+                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    try:
+        log = p.communicate(timeout=timeout)[0]
+    except subprocess.TimeoutExpired:
+        p.kill()
+        log = p.communicate()[0]
+        res.timedOut = True
+    res.duration = time.monotonic() - t0
+    res.returnCode = p.returncode
+    res.log = log.decode(errors='replace')
+    if verbose:
+        print(res.log)
+    if not res.timedOut:
+        res.output = Output(ode_file, out_file)
+    return res
+
+def run(ode_file=tmp_ode, set_file=tmp_set, verbose=False, context=None,
+        timeout=None, cache=None, overrides=None):
     ''' 
     Function runs xppaut with the given ode_file and, optionally, set_file and
     returns the output of the simulation.
     If verbose=True (default False) xppaut output messages are displayed. 
+    If context (RunContext) is given, the simulation is run in its working
+    directory and, by default, uses its copies of ode and set files.
+    If the run takes longer than timeout seconds (default None, i.e. no
+    limit), xppaut is killed and RuntimeError is raised; use runProcess to
+    get the exit status, duration and log of the run.
+    If cache (ResultCache) is given, the stored output is returned when 
+    the same simulation was already run; otherwise the new output is stored.
+    overrides is a dictionary {name: value} of parameters, initial 
+    conditions and options used instead of the ones in the files (see 
+    runProcess).
     '''
-    if not os.path.exists(ode_file):
-        raise IOError('No such file or directory: '+ode_file)
+    if cache != None:
+        (o_file, s_file, out_file, cmd) = _resolve(context, ode_file, set_file)[:4]
+        key = cache.key(o_file, s_file, cmd, overrides)
+        out = cache.get(key, o_file)
+        if out != None:
+            return out
+    res = runProcess(ode_file, set_file, timeout, verbose, context, overrides)
+    if res.timedOut:
+        raise RuntimeError('xppaut killed after %g s timeout: %s' % 
+                           (timeout, ' '.join(res.args)))
+    if cache != None:
+        cache.put(key, res.output)
+    return res.output
 
-    c = str(c_g) + ' '+ode_file+' -silent'
-    if os.path.exists(set_file):
-        c = c+' -setfile '+set_file
-    # By default XPP stdio is not displayed
-    if not verbose:
-        if os.name in ['posix','mac']:
-            c = c+' > /dev/null'
-        elif os.name == 'nt':
-            c = c+' > NUL'
-    os.system(c)
-    return Output(ode_file)
-
-def runLast(last_out=None, ode_file=tmp_ode, set_file=tmp_set, verbose=False):
+def runLast(last_out=None, ode_file=tmp_ode, set_file=tmp_set, verbose=False,
+            context=None, timeout=None, cache=None, overrides=None):
     ''' 
     Function runs xppaut with the given ode_file and, optionally, set_file using 
     the last_out as the initial conditions (if not provided runs a clean simulation)
     and returns the output of the simulation.
     If verbose=True (default False) xppaut output messages are displayed. 
+    If context (RunContext) is given, the simulation is run in its working
+    directory and, by default, uses its copies of ode and set files.
+    timeout, cache and overrides are passed to run; initial conditions in
+    overrides apply only to the first run (if last_out is not given).
     '''
+    (ode_file, set_file) = _resolve(context, ode_file, set_file)[:2]
     if last_out == None:
-        last_out = run(ode_file, set_file, verbose)
+        last_out = run(ode_file, set_file, verbose, context, timeout, cache,
+                       overrides)
     
     # Set the last point of the previous simulation as the initial conditions
     pars = parse.readOdePars(ode_file, False, True, False)
@@ -83,32 +272,339 @@ def runLast(last_out=None, ode_file=tmp_ode, set_file=tmp_set, verbose=False):
     else:
         parse.changeOde(pars, ode_file)
     
-    return run(ode_file, set_file, verbose)
+    # Initial conditions overrides would replace the ones just set
+    if overrides != None:
+        (new_pars, new_inits, new_opts) = \
+            parse.loadOdeModel(ode_file).splitOverrides(overrides)
+        overrides = dict(new_pars)
+        overrides.update(new_opts)
+    return run(ode_file, set_file, verbose, context, timeout, cache, overrides)
 
-def createTmp(ode_file=None, set_file=None):
+def runChain(segments, ode_file=tmp_ode, set_file=tmp_set, last_out=None,
+             concat=False, verbose=False, context=None, timeout=None):
     '''
-    Function creates temporary copies of ode and set files.
+    Function runs a chain of simulations, each one starting from the last
+    point of the previous one (the first starts from the last point of
+    last_out or, if not given, from the initial conditions in the files).
+    segments is either the number of segments or a list of overrides (see
+    run; None for no changes), one per segment; initial conditions given
+    in the overrides of a segment replace the chained ones (e.g. to kick
+    a variable). Only the initial conditions are generated for each 
+    segment, ode and set files are not changed.
+    Returns the list of outputs or, if concat=True (default False), a single
+    Output with the segments joined (time made continuous and the repeated
+    first point of each segment dropped).
     '''
+    (o_file, s_file) = _resolve(context, ode_file, set_file)[:2]
+    if isinstance(segments, int):
+        segments = [None]*segments
+    if len(segments) == 0:
+        raise ValueError('No segments to run')
+    model = parse.loadOdeModel(o_file)
+    # State variables are the columns following time
+    names = model.vars
+    state = None
+    if last_out != None:
+        state = last_out.getRawData()[-1, 1:len(names)+1]
+
+    outs = []
+    data = None
+    n = 0
+    for (i, seg) in enumerate(segments):
+        # Initial conditions given for the segment replace the chained ones
+        overrides = {}
+        if state is not None:
+            overrides.update(zip([name.lower() for name in names], state))
+        for (k, v) in (seg or {}).items():
+            overrides.pop(k.lower(), None)
+            overrides[k] = v
+        res = runProcess(ode_file, set_file, timeout, verbose, context,
+                         overrides)
+        if res.timedOut:
+            raise RuntimeError('xppaut killed after %g s timeout: %s' %
+                               (timeout, ' '.join(res.args)))
+        raw = res.output.getRawData()
+        if len(raw) == 0:
+            raise RuntimeError('Segment %i of the chain returned no data' % i)
+        state = raw[-1, 1:len(names)+1].copy()
+        if not concat:
+            outs.append(res.output)
+            continue
+        if data is None:
+            # Segments are usually of equal length; grown if they are not
+            data = np.empty((len(raw)*len(segments), raw.shape[1]))
+            data[:len(raw)] = raw
+            n = len(raw)
+            continue
+        raw = raw[1:]
+        if n+len(raw) > len(data):
+            data = np.concatenate((data, np.empty((n+len(raw)-len(data),
+                                                   data.shape[1]))))
+        data[n:n+len(raw)] = raw
+        # Time of the segment starts where the previous one ended
+        data[n:n+len(raw), 0] += data[n-1, 0]-res.output.getRawData()[0, 0]
+        n += len(raw)
+
+    if not concat:
+        return outs
+    out = Output(o_file, load=False)
+    out.setRawData(data[:n])
+    return out
+
+def createTmp(ode_file=None, set_file=None, context=None):
+    '''
+    Function creates temporary copies of ode and set files (in the working
+    directory of context, if given).
+    '''
+    (tmp_o, tmp_s) = _resolve(context)[:2]
     if ode_file != None:
-        shutil.copy(ode_file, tmp_ode)
+        shutil.copy(ode_file, tmp_o)
     if set_file != None:
-        shutil.copy(set_file, tmp_set)
+        shutil.copy(set_file, tmp_s)
     if ode_file == None and set_file == None:
         print('Warning! No files where created, both ode and set arguments are None.')
 
-def deleteTmp(del_ode=True, del_set=True):
+def deleteTmp(del_ode=True, del_set=True, context=None):
     '''
-    Function deletes temporary copies of ode and set files.
+    Function deletes temporary copies of ode and set files (from the working
+    directory of context, if given).
     '''
-    if del_ode and os.path.exists(tmp_ode):
-        os.remove(tmp_ode)
-    if del_set and os.path.exists(tmp_set):
-        os.remove(tmp_set)
+    (tmp_o, tmp_s) = _resolve(context)[:2]
+    if del_ode and os.path.exists(tmp_o):
+        os.remove(tmp_o)
+    if del_set and os.path.exists(tmp_s):
+        os.remove(tmp_s)
 
-def cleanUp():
+def cleanUp(context=None):
     '''
     Function performs a clean up (deletes temporary and output files).
     '''
-    deleteTmp()
-    if os.path.exists('output.dat'):
-        os.remove('output.dat')
+    parse.forgetOdeModels(_resolve(context)[0])
+    deleteTmp(context=context)
+    (out_file, cwd) = _resolve(context)[2::2]
+    _removeOutput(out_file)
+    # Files generated for overrides
+    for fn in (tmp_par, tmp_ic, tmp_opt):
+        if cwd != None:
+            fn = os.path.join(cwd, fn)
+        parse.forgetOdeModels(fn)
+        if os.path.exists(fn):
+            os.remove(fn)
+
+def _expandGrid(param_grid, ode_file):
+    '''
+    Function expands param_grid into a list of parameter lists (one per 
+    simulation). param_grid can be either a dictionary {name: values}, 
+    expanded as a Cartesian product in the order of the keys, or a list 
+    whose elements are parameter lists (as for changeOde) or dictionaries
+    {name: value}. Names given in dictionaries are checked as overrides 
+    (see parse.OdeModel.splitOverrides).
+    '''
+    model = parse.loadOdeModel(ode_file)
+    def toPars(d):
+        pars = []
+        for (tp, vals) in zip(['par', 'init', '@'], model.splitOverrides(d)):
+            pars += [[tp, n, v] for (n, v) in vals.items()]
+        return pars
+
+    if isinstance(param_grid, dict):
+        names = list(param_grid.keys())
+        return [toPars(dict(zip(names, v))) 
+                for v in itertools.product(*[param_grid[n] for n in names])]
+    
+    grid = []
+    for g in param_grid:
+        if isinstance(g, dict):
+            grid.append(toPars(g))
+        else:
+            grid.append([list(p) for p in g])
+    return grid
+
+def _sweepFiles(ode_file, set_file):
+    '''
+    Function checks the sweep files and returns their absolute paths.
+    '''
+    if not os.path.exists(ode_file):
+        raise IOError('No such file or directory: '+ode_file)
+    if set_file != None and not os.path.exists(set_file):
+        raise IOError('No such file or directory: '+set_file)
+    if set_file != None:
+        set_file = os.path.abspath(set_file)
+    return (os.path.abspath(ode_file), set_file)
+
+def _sweepPoint(args):
+    '''
+    Function runs a single point of a sweep in its own run context; the
+    point's values are passed to xppaut as overrides, so the sweep files 
+    are only read.
+    '''
+    (ode_file, set_file, pars, cmd, tmp_dir, timeout, verbose) = args
+    with RunContext(None, None, cmd, tmp_dir) as ctx:
+        return runProcess(ode_file, set_file or tmp_set, timeout, verbose, ctx,
+                          _overrides(pars)).output
+
+def _overrides(pars):
+    '''
+    Function converts a parameter list (as for changeOde) into overrides.
+    '''
+    return dict([(p[1], p[2]) for p in pars])
+
+def _stack(outs):
+    '''
+    Function stacks the raw data of outs into an array of shape (number
+    of outputs, rows, columns). If some outputs are missing (None, e.g. 
+    timed out) or shorter than the others (e.g. stopped by BOUND), the 
+    array is padded with NaN and returned as a masked array with the 
+    padding masked.
+    '''
+    raws = [o.getRawData() if o != None else None for o in outs]
+    shapes = [r.shape for r in raws if r is not None]
+    if len(shapes) == len(raws) and len(set(shapes)) == 1:
+        return np.array(raws)
+    rows = max([sh[0] for sh in shapes] or [0])
+    cols = max([sh[1] for sh in shapes] or [0])
+    data = np.full((len(raws), rows, cols), np.nan)
+    mask = np.ones(data.shape, dtype=bool)
+    for (i, r) in enumerate(raws):
+        if r is not None:
+            data[i, :r.shape[0], :r.shape[1]] = r
+            mask[i, :r.shape[0], :r.shape[1]] = False
+    return np.ma.masked_array(data, mask)
+
+def runSweep(ode_file, param_grid, set_file=None, workers=None, 
+             stack=False, tmp_dir=None, timeout=None, verbose=False):
+    '''
+    Function runs a parameter sweep of ode_file (and, optionally, set_file)
+    on a pool of worker processes and returns the list of outputs in the 
+    grid order. Each simulation is run in its own RunContext, i.e. in 
+    a private scratch directory; the values of the point are passed to
+    xppaut as overrides (see runProcess), so ode and set files are shared
+    read-only. 
+    param_grid is either a dictionary {name: values} (Cartesian product 
+    of values is simulated) or a list of parameter lists/dictionaries, one
+    per simulation. If stack=True (default False) the raw data is returned 
+    as a single array of shape (number of points, rows, columns); if some
+    points timed out or are shorter, it is a NaN padded masked array. workers
+    defaults to the number of CPUs; workers=1 runs the sweep serially in 
+    the current process. Scratch directories are created in tmp_dir (by 
+    default in the system temporary directory). Simulations running longer
+    than timeout seconds are killed and their outputs are None.
+    '''
+    (ode_file, set_file) = _sweepFiles(ode_file, set_file)
+    grid = _expandGrid(param_grid, ode_file)
+    args = [(ode_file, set_file, pars, c_g, tmp_dir, timeout, verbose) 
+            for pars in grid]
+    
+    if workers == 1:
+        outs = [_sweepPoint(a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            outs = list(pool.map(_sweepPoint, args))
+    
+    if stack:
+        return _stack(outs)
+    return outs
+
+async def arunProcess(ode_file=tmp_ode, set_file=tmp_set, timeout=None, 
+                      verbose=False, context=None, overrides=None):
+    '''
+    Coroutine runs xppaut as an asyncio subprocess and returns RunResult;
+    arguments have the same meaning as for runProcess. If the coroutine is
+    cancelled, xppaut is killed before the cancellation is propagated.
+    '''
+    (ode_file, set_file, out_file, cmd, cwd) = _resolve(context, ode_file, set_file)
+    if not os.path.exists(ode_file):
+        raise IOError('No such file or directory: '+ode_file)
+    _removeOutput(out_file)
+
+    args = _command(cmd, ode_file, set_file, overrides, cwd)
+    res = RunResult(args)
+    t0 = time.monotonic()
+    p = await asyncio.create_subprocess_exec(*args, cwd=cwd, 
+                                             stdin=subprocess.DEVNULL,
+                                             stdout=subprocess.PIPE, 
+                                             stderr=subprocess.STDOUT)
+    try:
+        log = (await asyncio.wait_for(p.communicate(), timeout))[0]
+    except asyncio.TimeoutError:
+        p.kill()
+        log = await p.stdout.read()
+        await p.wait()
+        res.timedOut = True
+    except asyncio.CancelledError:
+        p.kill()
+        await p.wait()
+        raise
+    res.duration = time.monotonic() - t0
+    res.returnCode = p.returncode
+    res.log = log.decode(errors='replace')
+    if verbose:
+        print(res.log)
+    if not res.timedOut:
+        # Parsing large outputs should not block the event loop
+        loop = asyncio.get_running_loop()
+        res.output = await loop.run_in_executor(None, Output, ode_file, out_file)
+    return res
+
+async def arun(ode_file=tmp_ode, set_file=tmp_set, verbose=False, context=None,
+               timeout=None, overrides=None):
+    '''
+    Coroutine version of run; xppaut is run as an asyncio subprocess and 
+    is killed if the coroutine is cancelled.
+    '''
+    res = await arunProcess(ode_file, set_file, timeout, verbose, context,
+                            overrides)
+    if res.timedOut:
+        raise RuntimeError('xppaut killed after %g s timeout: %s' % 
+                           (timeout, ' '.join(res.args)))
+    return res.output
+
+async def aiterSweep(ode_file, param_grid, set_file=None, concurrency=None,
+                     tmp_dir=None, timeout=None, verbose=False):
+    '''
+    Asynchronous generator runs a parameter sweep (see runSweep for the 
+    arguments) with at most concurrency (default: number of CPUs) xppaut
+    processes at a time and yields (index, output) pairs in the order of 
+    completion; index is the position of the point in the grid. If the 
+    generator is closed or cancelled, the pending runs are cancelled and
+    their xppaut processes killed.
+    '''
+    (ode_file, set_file) = _sweepFiles(ode_file, set_file)
+    grid = _expandGrid(param_grid, ode_file)
+    if concurrency == None:
+        concurrency = os.cpu_count() or 1
+    sem = asyncio.Semaphore(concurrency)
+    cmd = c_g
+
+    async def point(i, pars):
+        async with sem:
+            with RunContext(None, None, cmd, tmp_dir) as ctx:
+                res = await arunProcess(ode_file, set_file or tmp_set, timeout,
+                                        verbose, ctx, _overrides(pars))
+                return (i, res.output)
+
+    tasks = [asyncio.ensure_future(point(i, pars)) 
+             for (i, pars) in enumerate(grid)]
+    try:
+        for t in asyncio.as_completed(tasks):
+            yield await t
+    finally:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def arunSweep(ode_file, param_grid, set_file=None, concurrency=None,
+                    stack=False, tmp_dir=None, timeout=None, verbose=False):
+    '''
+    Coroutine version of runSweep; the simulations are run as asyncio 
+    subprocesses, at most concurrency (default: number of CPUs) at a time.
+    Returns the outputs in the grid order (None for timed out runs).
+    '''
+    outs = []
+    async for (i, out) in aiterSweep(ode_file, param_grid, set_file, 
+                                     concurrency, tmp_dir, timeout, verbose):
+        outs.append((i, out))
+    outs = [o for (i, o) in sorted(outs, key=lambda x: x[0])]
+    if stack:
+        return _stack(outs)
+    return outs
@@ -30,11 +30,19 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 # Reading XPPAut AllInfo file
 ####
 import os
+import json
 import numpy as np #@UnresolvedImport
 
+# Binary snapshot: magic, header length, JSON header, aligned arrays
+snapshot_magic = b'XPPYAI01'
+_snapshot_align = 64
+
 class AllInfo:
     '''
     Class stores and manages data from XPPAut allinfo data file.
+    Branches are indexed once: the rows are stably sorted by the branch 
+    number, so each branch is a contiguous slice (in the original order of
+    its points) and stability changes are found for all of them at once.
     '''
     def __init__(self, file_name=None):
         '''
@@ -43,21 +51,26 @@ class AllInfo:
         self.__raw_data = None
         self.__branches = []
         self.noVar = 0
+        self.__clearIndex()
         # If file name is given try to load the file  
         if file_name != None and os.path.exists(file_name):
-            self.__raw_data = np.loadtxt(file_name)
-            # Calculate the number of variables
-            self.noVar = int((self.__raw_data.shape[1]-5)/4)
+            if isSnapshot(file_name):
+                self.load(file_name)
+            else:
+                self.loadRawData(file_name)
     
+    def __clearIndex(self):
+        self.__order = None   # raw rows in the order of sorted
+        self.__sorted = None  # rows sorted by branch
+        self.__starts = None  # offsets of branches in sorted rows (+ end)
+        self.__changes = None # rows of sorted, where the stability changes
+
     def loadRawData(self, file_name):
         '''
         Raw data loader
         '''
         if os.path.exists(file_name):
-            self.__raw_data = np.loadtxt(file_name)
-            # Calculate the number of variables
-            self.noVar = int((self.__raw_data.shape[1]-5)/4)
-            return True
+            return self.setRawData(np.loadtxt(file_name, ndmin=2))
         else:
             return False
    
@@ -66,9 +79,11 @@ class AllInfo:
         Raw data setter
         '''
         if isinstance(raw_data,np.ndarray):
-            set.__raw_data = raw_data
+            self.__raw_data = raw_data
             # Calculate the number of variables
             self.noVar = int((self.__raw_data.shape[1]-5)/4)
+            self.__branches = []
+            self.__clearIndex()
             return True
         else:
             return False
@@ -77,25 +92,31 @@ class AllInfo:
         '''
         Raw data getter
         '''
+        if self.__raw_data is None and self.__sorted is not None:
+            # Loaded from a snapshot, restore the original order of rows
+            self.__raw_data = np.empty(self.__sorted.shape)
+            self.__raw_data[self.__order] = self.__sorted
         return self.__raw_data
 
     def findBranches(self):
         '''
-        Finds all branches in the raw data
+        Finds all branches in the raw data and builds the branch index
         '''
-        if self.__raw_data == None:
+        raw = self.getRawData()
+        if raw is None:
             return False
         
-        # Scan file for branches
-        bl = []
-        for b in self.__raw_data[:,1]:
-            try:
-                i = bl.index(b)
-            except ValueError:
-                i = -1 # no match
-            if i == -1:
-                bl.append(b)
-        self.__branches = sorted(bl)
+        self.__order = np.argsort(raw[:,1], kind='stable')
+        self.__sorted = raw[self.__order]
+        (bl, starts) = np.unique(self.__sorted[:,1], return_index=True)
+        self.__starts = np.append(starts, len(self.__sorted))
+        self.__branches = bl.tolist()
+        # Stability changes; each branch starts from stability 0
+        st = self.__sorted[:,0]
+        prev = np.empty_like(st)
+        prev[1:] = st[:-1]
+        prev[starts] = 0
+        self.__changes = np.flatnonzero(st != prev)
         return True
 
     def findParts(self, branchArr):
@@ -103,12 +124,11 @@ class AllInfo:
         Finds parts in the given branch array 
         (branch extracted by e.g. getBranch) 
         '''
-        parts = []; last = 0
-        for i in range(0,branchArr.shape[0]):
-            if branchArr[i,0] != last:
-                parts.append(i)
-                last = branchArr[i,0]
-        return parts
+        st = branchArr[:,0]
+        prev = np.empty_like(st)
+        prev[1:] = st[:-1]
+        prev[:1] = 0
+        return np.flatnonzero(st != prev).tolist()
 
     def getBranches(self):
         '''
@@ -119,25 +139,33 @@ class AllInfo:
 
         return self.__branches
 
+    def __slice(self, nr):
+        '''
+        Returns the (start, end) rows of branch nr in the index or None
+        '''
+        if self.__sorted is None and not self.findBranches():
+            return None
+        k = np.searchsorted(self.__sorted[self.__starts[:-1],1], nr)
+        if k == len(self.__branches) or self.__branches[k] != nr:
+            return None # no match
+        return (self.__starts[k], self.__starts[k+1])
+
     def getBranch(self, nr, getParts=False):
         '''
         Function returns data of branch number nr
         additionally it cen return list with indexes of parts
-        of the branch (stability wise)
+        of the branch (stability wise). The data is a view of the 
+        branch index, so it should not be modified.
         '''
-        if len(self.__branches) == 0:
-            self.findBranches()
-        
-        try:
-            self.__branches.index(nr)
-        except ValueError:
+        sl = self.__slice(nr)
+        if sl == None:
             return None # no match
-
-        i = np.nonzero(self.__raw_data[:,1] == nr)
-        retArr = self.__raw_data[i[0],:]
+        (s, e) = sl
+        retArr = self.__sorted[s:e]
         # If we want additional parts array
         if getParts:
-            parts = self.findParts(retArr)
+            c = self.__changes
+            parts = (c[np.searchsorted(c, s):np.searchsorted(c, e)]-s).tolist()
             return (retArr, parts)
         # Else, just return the branch array
         return retArr          
@@ -148,12 +176,12 @@ class AllInfo:
         additionally it cen return list with indexes of parts
         of the branch (stability wise)
         '''
-        (b,p) = self.getBranch(nr,True)
-        if b == None:
+        if self.__slice(nr) == None:
             return None
+        (b,p) = self.getBranch(nr,True)
             
         # Find starting point
-        i = np.ix_(b[:,2]==b[0,2],b[:,3]==b[0,3])[0].ravel()
+        i = np.flatnonzero(b[:,2]==b[0,2])
         # If the branch can't be flipped, return
         try:
             i = i[1]
@@ -162,13 +190,82 @@ class AllInfo:
                 return (b,p)
             else:
                 return b
-        # Change the stability of the first point to the proper one
-        b[0,0] = b[1,0]
         # Stack two arrays togather in better order
         retArr = np.vstack((np.flipud(b[0:i,:]),b[i+1:,:]))
+        # Change the stability of the first point to the proper one
+        retArr[i-1,0] = b[1,0]
         # If we want additional parts array
         if getParts:
             parts = self.findParts(retArr)
             return (retArr, parts)
         # Else, just return the branch array
         return retArr          
+
+    def save(self, file_name):
+        '''
+        Function saves the data, noVar and the branch index in a binary
+        snapshot file, which can be reopened quickly with load (or the 
+        constructor).
+        '''
+        if self.__sorted is None and not self.findBranches():
+            return False
+        arrays = [('sorted', self.__sorted), ('order', self.__order),
+                  ('starts', self.__starts), ('changes', self.__changes)]
+        arrays = [(n, np.ascontiguousarray(a)) for (n, a) in arrays]
+        # Offsets are relative to the (aligned) end of the header
+        desc = {}
+        off = 0
+        for (n, a) in arrays:
+            desc[n] = [a.dtype.str, list(a.shape), off]
+            off += -(-a.nbytes//_snapshot_align)*_snapshot_align
+        head = json.dumps({'noVar': self.noVar, 'arrays': desc}).encode()
+        size = -(-(len(snapshot_magic)+8+len(head))//_snapshot_align)*_snapshot_align
+        f = open(file_name, 'wb')
+        f.write(snapshot_magic)
+        f.write(np.uint64(len(head)).tobytes())
+        f.write(head)
+        for (n, a) in arrays:
+            f.seek(size+desc[n][2])
+            f.write(a.tobytes())
+        f.close()
+        return True
+
+    def load(self, file_name, mmap=True):
+        '''
+        Function loads a snapshot saved by save; the data is memory-mapped
+        (read-only) unless mmap=False, so only the branches used are read.
+        '''
+        if not isSnapshot(file_name):
+            return False
+        f = open(file_name, 'rb')
+        f.seek(len(snapshot_magic))
+        n = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        head = json.loads(f.read(n).decode())
+        f.close()
+        size = -(-(len(snapshot_magic)+8+n)//_snapshot_align)*_snapshot_align
+        arrays = {}
+        for (name, (dtype, shape, off)) in head['arrays'].items():
+            if mmap and np.prod(shape) > 0:
+                arrays[name] = np.memmap(file_name, dtype=dtype, mode='r',
+                                         offset=size+off, shape=tuple(shape))
+            else:
+                arrays[name] = np.fromfile(file_name, dtype=dtype, 
+                                           count=int(np.prod(shape)),
+                                           offset=size+off).reshape(shape)
+        self.__raw_data = None
+        self.noVar = head['noVar']
+        self.__sorted = arrays['sorted']
+        self.__order = arrays['order']
+        self.__starts = arrays['starts']
+        self.__changes = arrays['changes']
+        self.__branches = self.__sorted[self.__starts[:-1],1].tolist()
+        return True
+
+def isSnapshot(file_name):
+    '''
+    Function checks if file_name is an AllInfo binary snapshot.
+    '''
+    f = open(file_name, 'rb')
+    magic = f.read(len(snapshot_magic))
+    f.close()
+    return magic == snapshot_magic
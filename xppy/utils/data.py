@@ -26,6 +26,7 @@ ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
 (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 '''
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np #@UnresolvedImport
 
 #####
@@ -36,66 +37,228 @@ def getOrbit(data, start=None, eps=1e-4, col=1):
     Function extracts single orbit from given data and returns it.
     The orbit is ectracted from 'start' with accuracy of the end 
     point less than eps. The compared data is taken from 
-    the column col.
+    the column col. If no point returns within eps (e.g. the step 
+    is too large), the best return found by findOrbit is used.
     '''
     # If no starting point is specified, start from the minimal value
     if start == None:
         start = data[:,col].argmin()
 
-    stop = start+1
     avr = data[:,col].min() + \
           (np.abs(data[:,col].max()) + np.abs(data[:,col].min()))/2
-    crossAvr = False 
-    for i in range(start+1,data.shape[0]):
-        # Orbit have to cross maximu avarege value firs
-        if not crossAvr:
-            if data[i,col] >= avr:
-                crossAvr = True
-            else:
-                continue
+    x = data[start+1:,col]
+    # Orbit have to cross maximu avarege value firs
+    cross = np.flatnonzero(x >= avr)
+    if cross.shape[0] > 0:
         # After crossing the avarge value, we're looking for the end
-        if np.abs(data[start,col]-data[i,col]) <= eps:
-            stop = i+1
-            break
-    return data[start:stop,:]
+        ret = np.flatnonzero(np.abs(data[start,col]-x[cross[0]:]) <= eps)
+        if ret.shape[0] > 0:
+            stop = start+1+cross[0]+ret[0]+1
+            return data[start:stop,:]
+    try:
+        return findOrbit(data, start, None, col)[0]
+    except ValueError:
+        print('Warning! No orbit found, returning the starting point only.')
+        return data[start:start+1,:]
+
+def findOrbit(data, start=None, eps=None, col=1, cols=None, tcol=0):
+    '''
+    Function extracts single orbit from given data and returns tuple
+    (orbit, period, error). By default the orbit starts at the minimum of
+    the column col in the first half of the data. The candidate ends of the orbit are between
+    the crossings of the middle value of the column col (the trajectory
+    has to leave the side of the starting point and come back); in each
+    candidate window the point closest to the starting point is taken. 
+    The distance is calculated in the columns cols (by default all except
+    time column tcol) scaled by their ranges, and is returned as error.
+    If eps is None the first candidate is returned, otherwise the first
+    one with error not greater than eps (if no candidate is that close, 
+    the closest one). If no return to the starting point is found, 
+    ValueError is raised.
+    '''
+    # If no starting point is specified, start from the minimal value in
+    # the first half of the data (so there is room for the return)
+    if start == None:
+        start = data[:data.shape[0]//2+1,col].argmin()
+    if cols == None:
+        cols = [c for c in range(data.shape[1]) if c != tcol]
+
+    mid = (data[:,col].max() + data[:,col].min())/2
+    above = data[start:,col] >= mid
+    # Crossings alternate between leaving and coming back to the side
+    # of the starting point; samples after an odd number of crossings 
+    # are on the way back, candidate window k is after 2k+1 crossings
+    chg = np.zeros(above.shape[0], int)
+    chg[1:] = above[1:] != above[:-1]
+    ncross = np.cumsum(chg)
+    back = np.flatnonzero(ncross % 2 == 0)
+    back = back[ncross[back] > 0]
+    if back.shape[0] == 0:
+        raise ValueError('No periodic orbit found!')
+
+    st = data[start:,cols]
+    scale = np.ptp(st, axis=0)
+    scale[scale == 0] = 1
+    dist = np.sqrt(np.square((st[back,:]-st[0,:])/scale).sum(axis=1))
+    # The closest point of each window
+    win = ncross[back]//2
+    o = np.lexsort((dist, win))
+    first = np.ones(o.shape[0], bool)
+    first[1:] = win[o][1:] != win[o][:-1]
+    best = o[first]
+    if eps == None:
+        i = best[0]
+    elif (dist[best] <= eps).any():
+        i = best[np.flatnonzero(dist[best] <= eps)[0]]
+    else:
+        i = best[dist[best].argmin()]
+
+    stop = start+back[i]
+    return (data[start:stop+1,:], data[stop,tcol]-data[start,tcol], dist[i])
+
+def findOrbits(datas, start=None, eps=None, col=1, cols=None, tcol=0):
+    '''
+    Function extracts orbits (see findOrbit) from many runs at once; datas
+    is a list (or 3d array) of data arrays or Output objects. Returns 
+    lists of orbits, and arrays of periods and errors; if no orbit is 
+    found in a run, its orbit is None, and period and error are NaN.
+    '''
+    orbits = []; per = []; err = []
+    for d in datas:
+        if hasattr(d, 'getRawData'):
+            d = d.getRawData()
+        try:
+            (o, p, e) = findOrbit(d, start, eps, col, cols, tcol)
+        except ValueError:
+            (o, p, e) = (None, np.nan, np.nan)
+        orbits.append(o); per.append(p); err.append(e)
+    return (orbits, np.array(per), np.array(err))
 
-def arcLength(data):
+def arcLength(data, cumulative=False):
     '''
-    Calculate the arclenght of the provided data.
+    Calculate the arclenght of the provided data (rows are points of 
+    the trajectory). If cumulative=True the array of arclenghts from the 
+    first point to each point is returned.
     '''
-    alen = 0
-    for i in range(0,data.shape[0]-1):
-        alen += np.linalg.norm(data[i+1,:]-data[i,:])
-    return alen
+    seg = np.sqrt(np.square(np.diff(data, axis=0)).sum(axis=1))
+    if cumulative:
+        return np.concatenate(([0.0], np.cumsum(seg)))
+    return seg.sum()
 
 def resample1d(data, ns):
     '''
-    Function resamples the given data (1d line [x,y] data) using even 
-    arc lenght (linear interpolation). New (resampled) data is returned.  
+    Function resamples the given data (1d line of points in N dimensions,
+    e.g. [x,y]) using even arc lenght (linear interpolation). New 
+    (resampled) data is returned.  
     '''
-    # Calculating arc lenght of the bit and the whole data
-    tot_alen = arcLength(data)
-    bit_alen = tot_alen/(ns-1)
-    # Chopping the line unto even ns segments
-    new_data = np.ones((ns,2))*np.NaN
+    # Calculating arc lenght at the data points and of the bit
+    cum = arcLength(data, True)
+    bit_alen = cum[-1]/(ns-1)
+    # Chopping the line unto even ns segments; each new point lies on 
+    # the first segment ending further than its arc lenght
+    new_data = np.ones((ns,data.shape[1]))*np.nan
     new_data[0,:] = data[0,:]
-    cur_alen = arcLength(data[[0,1],:])
-    old_alen = 0
-    j = 0
-    for i in range(1,ns-1):
-        while j <= data.shape[0]-2:
-            if cur_alen > (i)*bit_alen:
-                # Slope of a line
-                a = ((i)*bit_alen-old_alen)/(cur_alen-old_alen)
-                new_data[i,:] = data[j,:] + a*(data[j+1,:]-data[j,:])
-                break
-            else:
-                j += 1
-                old_alen = cur_alen
-                cur_alen += np.linalg.norm(data[j,:]-data[j+1,:])
+    alen = np.arange(1,ns-1)*bit_alen
+    j = np.searchsorted(cum, alen, side='right')
+    ok = j < data.shape[0]
+    j = j[ok]
+    # Slope of a line
+    a = (alen[ok]-cum[j-1])/(cum[j]-cum[j-1])
+    new_data[1:-1,:][ok] = data[j-1,:] + a[:,None]*(data[j,:]-data[j-1,:])
     new_data[-1,:] = data[-1,:] # First and last points sould be the same
     return new_data
 
+def _slopes(data, cols=[0,1]):
+    '''
+    Function returns slopes of the tangent lines between consecutive samples
+    of the given two columns; slope i is calculated between samples i-1 and i
+    (the first one is NaN).
+    '''
+    d = np.diff(data[:,cols], axis=0)
+    sl = np.empty(data.shape[0])
+    sl[:1] = np.nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sl[1:] = d[:,1]/d[:,0]
+    return sl
+
+def _next(idx, i, stop=None):
+    '''
+    Function returns the first value in sorted index array idx not less 
+    than i (and less than stop), or None if there is no such value.
+    '''
+    k = idx.searchsorted(i)
+    if k < idx.shape[0] and (stop == None or idx[k] < stop):
+        return int(idx[k])
+    return None
+
+def _spikeIndex(sl, threshold, sampleThr):
+    '''
+    Function precomputes the sample indexes of spike events from the array
+    of slopes sl (as returned by _slopes; slopes of many traces can be 
+    concatenated, as the first NaN slope of each trace separates them).
+    '''
+    n = sl.shape[0]
+    sg = np.sign(sl)
+    idx = np.arange(n)
+    # Stretches of samples with slope steeper than threshold; for each 
+    # sample the beginning of its stretch and the next non-steep sample
+    steep = np.abs(sl) > threshold
+    beg = np.maximum.accumulate(np.where(steep, 0, idx+1))
+    nxt = np.minimum.accumulate(np.where(steep, n, idx)[::-1])[::-1]
+    # Slope sign changes (NaN slope always counts as a change)
+    chg = np.ones(n, bool)
+    chg[1:] = sg[1:] != sg[:-1]
+    # Sample indexes of the events of the spike
+    return (sg, steep, beg, nxt,
+            np.flatnonzero(steep & (sl > 0)),                          # up
+            np.flatnonzero(steep & (sl > 0) & (idx-beg+1 >= sampleThr)), # cand
+            np.flatnonzero(chg),                                       # top
+            np.flatnonzero(steep & (sg == -1)),                        # down
+            np.flatnonzero(~steep | chg))                              # bot
+
+def _spikeTrain(ind, start, stop, sampleThr):
+    '''
+    Function finds spikes between samples start and stop using the spike 
+    index ind (see _spikeIndex) and returns their begining, top and end 
+    sample indexes (relative to start).
+    '''
+    (sg, steep, beg, nxt, up, cand, top, down, bot) = ind
+    # List contain begining, top and end of the spike i
+    spb = []; spm = []; spe = []
+    # Go from spike to spike; i is the first sample of the search, the
+    # samples above threshold are counted from it
+    i = start+1
+    while i < stop:
+        # A spike begins when we passed sample threshold on positive slope
+        b = None
+        if steep[i]:
+            b = _next(up, i+max(sampleThr-1, 0), nxt[i])
+        if b == None:
+            b = _next(cand, int(nxt[i]) if steep[i] else i, stop)
+        if b == None:
+            break
+        spb.append(max(int(beg[b]), i)-1-start)
+        # If slopes have different sign we have midpoint/top
+        m = _next(top, b+1, stop)
+        if m == None:
+            break
+        spm.append(m-1-start)
+        # Looking for the steep slope down
+        d = _next(down, m+1, stop)
+        if d == None or d+1 >= stop:
+            break
+        # Looking for the bottom of the spike; the first slope is compared
+        # with the one at the midpoint
+        e = d+1
+        if steep[e] and sg[e] == sg[m]:
+            e = _next(bot, e+1, stop)
+            if e == None:
+                break
+        spe.append(e-1-start)
+        i = e+1
+
+    return (spb,spm,spe)
+
 def findSpikes(data, cols=[0,1], threshold=20, sampleThr=3):
     '''
     Function finds spikes in the given two data columns data. 
@@ -106,56 +269,9 @@ def findSpikes(data, cols=[0,1], threshold=20, sampleThr=3):
     if len(cols) != 2:
         raise ValueError('List should contain to columns!')
     
-    st = 0 # Number of samples above threshold
-    # List contain begining, top and end of the spike i
-    spb = []; spm = []; spe = []
-    # Last slope
-    sl_last = 0
-    # Spike flag (0 - nothing, 1 - passed begining, 
-    # 2 - passed midpoint, 3 - on the way down (on steep slope))
-    spf = 0
-    for i in range(1,data.shape[0]):
-        # Difference of the given components
-        dx,dy = data[i,cols] - data[i-1,cols]
-        # Slope of tangent line
-        sl = dy/dx
-
-        # Looking for midpoint
-        if spf == 1:
-            # If slopes have different sign we have midpoint/top
-            if np.sign(sl_last) != np.sign(sl):
-                spm.append(i-1)
-                spf = 2
-            sl_last = sl
-            continue
-        
-        # Looking for the steep slope down
-        if spf == 2:
-            if np.abs(sl) > threshold and np.sign(sl) == -1:
-                spf = 3
-            continue
-
-        # Looking for the bottom of the spike
-        if spf == 3:
-            if (not np.abs(sl) > threshold) or np.sign(sl_last) != np.sign(sl):
-                spe.append(i-1)
-                spf = 0
-                st = 0
-            sl_last = sl
-            continue
-
-        # A candidate for a spike
-        if np.abs(sl) > threshold:
-            st += 1
-            # If we passed sample threshold, we have begining of a spike
-            if st >= sampleThr and sl > 0:
-                spb.append(i-st)
-                spf = 1
-        else:
-            st = 0
-        sl_last = sl
-
-    return (spb,spm,spe)
+    sl = _slopes(data, cols)
+    ind = _spikeIndex(sl, threshold, sampleThr)
+    return _spikeTrain(ind, 0, sl.shape[0], sampleThr)
 
 def findADP(data, cols=[0,1], threshold=20, sampleThr=3):
     '''
@@ -164,31 +280,24 @@ def findADP(data, cols=[0,1], threshold=20, sampleThr=3):
     Threshold value according to (Naundorf et al. 2006).
     '''
     (spb, spm, spe) = findSpikes(data, cols, threshold, sampleThr)
+    sl = _slopes(data, cols)
+    # Samples where the slope is negative and steeper than the previous one
+    st = np.zeros(sl.shape[0], bool)
+    st[1:] = (np.abs(sl[1:]) > np.abs(sl[:-1])) & (sl[1:] < 0)
+    st = np.flatnonzero(st)
     adp = []
     # For each spike end
     for i in range(len(spe)):
-        # Calculating slope for the end of the spike
-        # Difference of the given components
-        dx,dy = data[spe[i],cols] - data[spe[i]-1,cols]
-        # Slope of tangent line
-        sl_last = dy/dx
         # If we have more spikes, look for ADP till the begining 
         # of the next spike, else look till the end of the data
         if i+1 < len(spe):
             j_end = spb[i+1]
         else:
             j_end = data.shape[0]
-        for j in range(spe[i]+1,j_end):
-            # Difference of the given components
-            dx,dy = data[j,cols] - data[j-1,cols]
-            # Slope of tangent line
-            sl = dy/dx
-            # We've found the potential ADP's end
-            if np.abs(sl) > np.abs(sl_last) and sl < 0:
-                if j-spe[i] > 2:
-                    adp.append(j)
-                break
-            sl_last = sl
+        # We've found the potential ADP's end
+        j = _next(st, spe[i]+1)
+        if j != None and j < j_end and j-spe[i] > 2:
+            adp.append(j)
     return adp
 
 def ISI(data, cols=[0,1], threshold=20, sampleThr=3):
@@ -237,3 +346,226 @@ def getTau(data, cols=[0,1]):
     # Index of the 63% crossing 
     i_63 = (d[:,cols[1]] >= v_63).nonzero()[0][0]
     return d[i_63,cols[1]] - d[0,cols[1]]
+
+#####
+# Batch processing of many traces
+#####
+def _traces(traces, cols, time=None):
+    '''
+    Function returns traces as a 3d array (traces, samples, columns) or 
+    a list of 2d arrays, and the columns to be used. traces can be a 3d
+    array, a list of 2d arrays or Output objects, or a 2d array with one
+    trace per row (then time, sample times, must be given).
+    '''
+    if isinstance(traces, np.ndarray):
+        if traces.ndim == 3:
+            return (traces, cols)
+        if traces.ndim == 2:
+            if time is None:
+                raise ValueError('Sample times are needed for 2d stack of traces!')
+            t = np.broadcast_to(np.asarray(time, float), traces.shape)
+            return (np.stack((t, traces), axis=2), [0,1])
+        raise ValueError('Traces should be 2d or 3d array!')
+    ret = []
+    for tr in traces:
+        if hasattr(tr, 'getRawData'):
+            tr = tr.getRawData()
+        ret.append(np.asarray(tr))
+    return (ret, cols)
+
+def _stackSlopes(traces, cols):
+    '''
+    Function returns concatenated slopes (see _slopes) of all traces and 
+    the offsets of traces in the concatenated array.
+    '''
+    if isinstance(traces, np.ndarray):
+        (m, n) = traces.shape[:2]
+        d = np.diff(traces[:,:,cols], axis=1)
+        sl = np.empty((m, n))
+        sl[:,:1] = np.nan
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sl[:,1:] = d[:,:,1]/d[:,:,0]
+        return (sl.ravel(), np.arange(m+1)*n)
+    if len(traces) == 0:
+        return (np.empty(0), np.zeros(1, int))
+    off = np.zeros(len(traces)+1, int)
+    off[1:] = np.cumsum([tr.shape[0] for tr in traces])
+    return (np.concatenate([_slopes(tr, cols) for tr in traces]), off)
+
+def _merge(parts):
+    '''
+    Function merges a list of (flat, offsets) pairs into one.
+    '''
+    flat = np.concatenate([p[0] for p in parts])
+    off = [np.zeros(1, int)]; n = 0
+    for p in parts:
+        off.append(p[1][1:]+n)
+        n += p[1][-1]
+    return (flat, np.concatenate(off))
+
+def _split(traces, workers):
+    '''
+    Function splits traces into at most workers parts.
+    '''
+    k = np.array_split(np.arange(len(traces)), workers)
+    return [traces[i[0]:i[-1]+1] for i in k if len(i) > 0]
+
+def splitRagged(flat, offsets):
+    '''
+    Function unpacks flat array with offsets (as returned by the batch 
+    functions) into a list of arrays, one per trace.
+    '''
+    return [flat[offsets[k]:offsets[k+1]] for k in range(len(offsets)-1)]
+
+def _nextArr(idx, i, stop):
+    '''
+    Vectorized _next: returns the first values in sorted index array idx 
+    not less than i and a mask telling which of them are less than stop.
+    '''
+    if idx.shape[0] == 0:
+        return (i, np.zeros(i.shape, bool))
+    k = np.searchsorted(idx, i)
+    r = idx[np.minimum(k, idx.shape[0]-1)]
+    return (r, (k < idx.shape[0]) & (r < stop))
+
+def _spikeTrains(ind, off, sampleThr):
+    '''
+    Function finds spikes in all the traces concatenated in spike index 
+    ind (see _spikeIndex); off are the offsets of the 
+    traces. The traces are processed in lockstep, one spike of every trace
+    per iteration. Returns flat arrays with offsets (see findSpikesBatch).
+    '''
+    (sg, steep, beg, nxt, up, cand, top, down, bot) = ind
+    start = off[:-1]; stop = off[1:]
+    # Events as (trace, index) arrays, one pair per iteration
+    ev = [[], [], []]
+    def add(j, tr, v):
+        ev[j].append((tr, v-start[tr]))
+    
+    tr = np.flatnonzero(start+1 < stop)
+    i = start[tr]+1
+    while tr.shape[0] > 0:
+        st = stop[tr]
+        # A spike begins when we passed sample threshold on positive slope
+        s0 = steep[i]
+        (b, ok) = _nextArr(up, i+max(sampleThr-1, 0), nxt[i])
+        ok &= s0
+        (b2, ok2) = _nextArr(cand, np.where(s0, nxt[i], i), st)
+        b = np.where(ok, b, b2); ok |= ok2
+        (tr, i, b, st) = (tr[ok], i[ok], b[ok], st[ok])
+        add(0, tr, np.maximum(beg[b], i)-1)
+        # If slopes have different sign we have midpoint/top
+        (m, ok) = _nextArr(top, b+1, st)
+        (tr, m, st) = (tr[ok], m[ok], st[ok])
+        add(1, tr, m-1)
+        # Looking for the steep slope down
+        (d, ok) = _nextArr(down, m+1, st)
+        ok &= d+1 < st
+        (tr, m, e, st) = (tr[ok], m[ok], d[ok]+1, st[ok])
+        # Looking for the bottom of the spike; the first slope is compared
+        # with the one at the midpoint
+        cont = steep[e] & (sg[e] == sg[m])
+        (e2, ok) = _nextArr(bot, e+1, st)
+        ok |= ~cont
+        e = np.where(cont, e2, e)
+        (tr, e) = (tr[ok], e[ok])
+        add(2, tr, e-1)
+        i = e+1
+        ok = i < stop[tr]
+        (tr, i) = (tr[ok], i[ok])
+    
+    ret = []
+    for j in range(3):
+        if len(ev[j]) == 0:
+            ret.append((np.zeros(0, int), np.zeros(len(off), int)))
+            continue
+        t = np.concatenate([e[0] for e in ev[j]])
+        v = np.concatenate([e[1] for e in ev[j]])
+        # Iterations give the events of a trace in order, a stable sort
+        # groups them by trace
+        o = np.argsort(t, kind='stable')
+        cnt = np.bincount(t, minlength=len(off)-1)
+        eoff = np.zeros(len(off), int)
+        eoff[1:] = np.cumsum(cnt)
+        ret.append((v[o], eoff))
+    return tuple(ret)
+
+def _spikesBatch(args):
+    '''
+    Function finds spikes in the prepared traces (see findSpikesBatch).
+    '''
+    (traces, cols, threshold, sampleThr) = args
+    (sl, off) = _stackSlopes(traces, cols)
+    ind = _spikeIndex(sl, threshold, sampleThr)
+    return _spikeTrains(ind, off, sampleThr)
+
+def findSpikesBatch(traces, cols=[0,1], threshold=20, sampleThr=3, 
+                    time=None, workers=None):
+    '''
+    Function finds spikes (see findSpikes) in many traces at once; traces
+    can be a 3d array (traces, samples, columns), a list of 2d arrays or
+    Output objects, or a 2d array with one trace per row (sample times are
+    then given in time). Slopes and thresholds of all traces are computed
+    in one pass and the traces are scanned in lockstep. Returns ((spb, spb_off), (spm, spm_off), (spe, spe_off)):
+    flat arrays of sample indexes (within a trace) of beginnings, tops and
+    ends of spikes with offsets of traces (see splitRagged). If workers 
+    is given, traces are distributed on a pool of worker processes.
+    '''
+    if len(cols) != 2:
+        raise ValueError('List should contain to columns!')
+    (traces, cols) = _traces(traces, cols, time)
+    if workers == None or workers < 2 or len(traces) < 2:
+        return _spikesBatch((traces, cols, threshold, sampleThr))
+    
+    args = [(p, cols, threshold, sampleThr) for p in _split(traces, workers)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        res = list(pool.map(_spikesBatch, args))
+    return tuple([_merge([r[j] for r in res]) for j in range(3)])
+
+def ISIBatch(traces, cols=[0,1], threshold=20, sampleThr=3, time=None,
+             workers=None):
+    '''
+    Function calculates ISI (see ISI) of many traces at once (see 
+    findSpikesBatch for the arguments) and returns flat array of ISI and 
+    offsets of traces; traces with less than 2 spikes have no ISI.
+    '''
+    (traces, cols) = _traces(traces, cols, time)
+    (spm, off) = findSpikesBatch(traces, cols, threshold, sampleThr, 
+                                 workers=workers)[1]
+    # Times of the spike tops
+    tr = np.repeat(np.arange(len(off)-1), np.diff(off))
+    if isinstance(traces, np.ndarray):
+        t = traces[tr,spm,cols[0]]
+    else:
+        t = np.array([traces[k][i,cols[0]] for (k,i) in zip(tr, spm)])
+    isi = np.diff(t)
+    # Drop the differences between the last spike of a trace and the 
+    # first of the next one
+    same = tr[1:] == tr[:-1]
+    cnt = np.maximum(np.diff(off)-1, 0)
+    isi_off = np.zeros(len(off), int)
+    isi_off[1:] = np.cumsum(cnt)
+    return (isi[same], isi_off)
+
+def getThresholdBatch(traces, cols=[0,1], time=None):
+    '''
+    Function returns threshold rows (see getThreshold) of many traces at 
+    once (see findSpikesBatch for the arguments) as a 2d array; the rows
+    of traces without threshold crossing are NaN.
+    '''
+    (traces, cols) = _traces(traces, cols, time)
+    if isinstance(traces, np.ndarray):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dv = np.diff(traces[:,:,cols[1]], axis=1)/np.diff(traces[:,:,cols[0]], axis=1)
+        cross = dv >= 20
+        i = cross.argmax(axis=1)
+        ret = traces[np.arange(traces.shape[0]),i,:].astype(float)
+        ret[~cross.any(axis=1),:] = np.nan
+        return ret
+    ret = []
+    for tr in traces:
+        try:
+            ret.append(getThreshold(tr, cols))
+        except IndexError:
+            ret.append(np.ones(tr.shape[1])*np.nan)
+    return np.array(ret)
@@ -27,45 +27,222 @@ ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
 SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 '''
 import os
+import json
+import itertools
 import numpy as np #@UnresolvedImport
 from xppy.parser import parse
 
+# Available data file loaders (see loadData). Since NumPy 1.23 np.loadtxt
+# is implemented in C and is the fastest and leanest of them; with older 
+# NumPy versions np.fromfile is several times faster than np.loadtxt
+loaders = ['loadtxt', 'fromfile', 'chunked']
+if tuple([int(v) for v in np.__version__.split('.')[:2]]) >= (1, 23):
+    default_loader = 'loadtxt'
+else:
+    default_loader = 'fromfile'
+
+def _countColumns(file_name):
+    '''
+    Function returns the number of columns in the first line of the data file.
+    '''
+    f = open(file_name, 'r')
+    line = f.readline()
+    f.close()
+    return len(line.split())
+
+def _iterBlocks(f, ncols, size=2**22):
+    '''
+    Generator reads opened data file f in blocks of about size bytes and 
+    yields them as arrays with ncols columns.
+    '''
+    while True:
+        lines = f.readlines(size)
+        if len(lines) == 0:
+            break
+        block = np.loadtxt(lines, ndmin=2)
+        if block.shape[1] != ncols:
+            raise ValueError('Wrong number of columns in file: %s' % (f.name,))
+        yield block
+
+def loadData(file_name='output.dat', loader=None, ncols=None):
+    '''
+    Function reads XPP data file (e.g. output.dat) with the given loader
+    (one of loaders, by default default_loader) and returns 2d data array.
+    The 'loadtxt' loader parses the file with np.loadtxt; the 'fromfile' 
+    loader parses the whole file with np.fromfile; the 'chunked' loader 
+    parses the file in blocks into a preallocated array (bounded parsing
+    overhead). If ncols (number of columns) is not given, it is read from 
+    the first line of the file. If a fast loader fails (e.g. rows of 
+    different length), the file is read with np.loadtxt.
+    '''
+    if loader == None:
+        loader = default_loader
+    if loader not in loaders:
+        raise ValueError('Unknown loader: %s' % (loader,))
+    if ncols == None and loader != 'loadtxt':
+        ncols = _countColumns(file_name)
+    if loader == 'loadtxt' or ncols == 0:
+        return np.loadtxt(file_name, ndmin=2)
+
+    if loader == 'fromfile':
+        data = np.fromfile(file_name, sep=' ')
+        if data.size % ncols != 0:
+            return np.loadtxt(file_name, ndmin=2)
+        return data.reshape(-1, ncols)
+
+    # Chunked loader; the number of rows is estimated from the file size
+    # and the length of the first line, the array grows if needed
+    f = open(file_name, 'r')
+    rows = int(os.path.getsize(file_name)/max(len(f.readline()), 1)) + 1
+    f.seek(0)
+    data = np.empty((rows, ncols))
+    n = 0
+    try:
+        for b in _iterBlocks(f, ncols):
+            if n + b.shape[0] > data.shape[0]:
+                data = np.resize(data, (max(2*data.shape[0], n + b.shape[0]), ncols))
+            data[n:n+b.shape[0],:] = b
+            n += b.shape[0]
+    except ValueError:
+        f.close()
+        return np.loadtxt(file_name, ndmin=2)
+    f.close()
+    return data[:n,:]
+
+def sidecarFiles(file_name):
+    '''
+    Function returns the names of the binary sidecar files (data, 
+    descriptor) of the data file file_name.
+    '''
+    return (file_name+'.npy', file_name+'.desc')
+
+def hasSidecar(file_name):
+    '''
+    Function checks if the data file file_name has an up-to-date binary 
+    sidecar (the data file itself may be removed).
+    '''
+    if not file_name:
+        return False
+    npy = sidecarFiles(file_name)[0]
+    if not os.path.exists(npy):
+        return False
+    if not os.path.exists(file_name):
+        return True
+    return os.path.getmtime(npy) >= os.path.getmtime(file_name)
+
+def saveSidecar(file_name, raw_data, desc=None):
+    '''
+    Function saves raw_data of the data file file_name in a column-major 
+    .npy sidecar file, so a single column is stored contiguously and, after
+    memory mapping, reading it touches only its own pages. The descriptor 
+    desc, if given, is saved alongside.
+    '''
+    (npy, dsc) = sidecarFiles(file_name)
+    # Write to a temporary file first, the sidecar appears complete or not at all
+    tmp = '%s.%i.tmp' % (npy, os.getpid())
+    f = open(tmp, 'wb')
+    np.save(f, np.asfortranarray(raw_data))
+    f.close()
+    os.replace(tmp, npy)
+    if desc != None:
+        f = open(dsc, 'w')
+        json.dump([[k, v] for (k, v) in desc.items()], f)
+        f.close()
+
+def loadSidecar(file_name, mmap=True):
+    '''
+    Function loads the sidecar of the data file file_name and returns 
+    (raw data, descriptor); the data is memory-mapped (read-only) unless 
+    mmap=False. The descriptor is None if it was not saved.
+    '''
+    (npy, dsc) = sidecarFiles(file_name)
+    if mmap:
+        raw_data = np.load(npy, mmap_mode='r')
+    else:
+        raw_data = np.load(npy)
+    desc = None
+    if os.path.exists(dsc):
+        f = open(dsc, 'r')
+        desc = dict([tuple(d) for d in json.load(f)])
+        f.close()
+    return (raw_data, desc)
+
+def iterData(file_name='output.dat', rows=100000, usecols=None):
+    '''
+    Generator parses XPP data file incrementally and yields arrays of at 
+    most rows rows; usecols (list of column numbers, default all) selects 
+    the columns to be parsed. Memory use is bounded by the block size.
+    '''
+    f = open(file_name, 'r')
+    try:
+        while True:
+            lines = list(itertools.islice(f, rows))
+            if len(lines) == 0:
+                break
+            yield np.loadtxt(lines, ndmin=2, usecols=usecols)
+    finally:
+        f.close()
+
 class Output:
     '''
     Class stores and manages data from XPPAut output data file.
     '''
-    def __init__(self, ode_file='', file_name='output.dat'):
+    def __init__(self, ode_file='', file_name='output.dat', loader=None,
+                 sidecar=True, load=True):
         '''
-        Constructor
+        Constructor; loader selects the data file loader (see loadData).
+        If sidecar=True (default) and the data file has an up-to-date 
+        binary sidecar (see saveSidecar), the data is memory-mapped from
+        it instead of being parsed. If load=False the data is not loaded
+        (it can be read later with loadRawData or iterChunks).
         '''
         self.__raw_data = None # Content of data file
         self.__desc     = None # Data descriptor, read from the ode_file
+        self.__file_name = file_name
         
-        if os.path.exists(file_name):
-            self.__raw_data = np.loadtxt(file_name)
+        if load:
+            self.loadRawData(file_name, loader, sidecar)
         
         if os.path.exists(ode_file):
             self.__desc = parse.readOdeVars(ode_file)
         
     
-    def loadRawData(self, file_name='output.dat'):
+    def loadRawData(self, file_name='output.dat', loader=None, sidecar=True):
         '''
-        Raw data loader
+        Raw data loader; loader selects the data file loader (see loadData).
+        If sidecar=True (default) an up-to-date binary sidecar is 
+        memory-mapped instead of parsing the data file.
         '''
-        if os.path.exists(file_name):
-            self.__raw_data = np.loadtxt(file_name)
-            return True
+        if sidecar and hasSidecar(file_name):
+            (self.__raw_data, desc) = loadSidecar(file_name)
+            if self.__desc == None:
+                self.__desc = desc
+        elif os.path.exists(file_name):
+            self.__raw_data = loadData(file_name, loader)
         else:
             return False
+        self.__file_name = file_name
+        return True
+
+    def saveSidecar(self, file_name=None):
+        '''
+        Function saves the raw data and descriptor in a binary sidecar of 
+        the data file (by default, the one the data was loaded from), so 
+        later Output constructions memory-map it instead of parsing text.
+        '''
+        if file_name == None:
+            file_name = self.__file_name
+        if self.__raw_data is None:
+            return False
+        saveSidecar(file_name, self.__raw_data, self.__desc)
+        return True
    
     def setRawData(self, raw_data):
         '''
         Raw data setter
         '''
         if isinstance(raw_data,np.ndarray):
-            set.__raw_data = raw_data
-            # Calculate the number of variables
-            self.noVar = int((self.__raw_data.shape[1]-5)/4)
+            self.__raw_data = raw_data
             return True
         else:
             return False
@@ -95,6 +272,41 @@ class Output:
         '''
         return self.__desc
      
+    def __column(self, name):
+        '''
+        Returns the column number of the variable name (or number).
+        '''
+        if type(name) is str:
+            return self.__desc[name]
+        return int(name)
+
+    def iterChunks(self, rows=100000, columns=None):
+        '''
+        Generator yields the data in blocks of at most rows rows, so long 
+        simulations can be processed with bounded memory. columns is a list
+        of variable names or column numbers (default all columns). If the 
+        data is not loaded, an up-to-date sidecar is memory-mapped or the 
+        data file is parsed incrementally.
+        '''
+        cols = None
+        if columns != None:
+            if type(columns) is not list:
+                columns = [columns]
+            cols = [self.__column(n) for n in columns]
+
+        data = self.__raw_data
+        if data is None and hasSidecar(self.__file_name):
+            data = loadSidecar(self.__file_name)[0]
+        if data is None:
+            for b in iterData(self.__file_name, rows, cols):
+                yield b
+            return
+        for i in range(0, data.shape[0], rows):
+            if cols == None:
+                yield data[i:i+rows,:]
+            else:
+                yield data[i:i+rows,cols]
+
     def __getitem__(self, name):
         # TODO Maybe do it more efficiently 
         # Sequence value
@@ -27,16 +27,30 @@ ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
 SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 '''
 
+import os
+import warnings
 import numpy as np #@UnresolvedImport
 
 ####
 # Reading XPPAut Auto output files (.p and .q)
 ####
 class Solution:
+    '''
+    Class stores a single solution of AUTO solution file: the control 
+    header (ctrl: branch, point, type, label, number of free parameters, 
+    ..., number of points, number of columns, number of lines of the 
+    block, ...), the solution points (sol) and their derivatives (drv),
+    the free parameter indices (icp), the direction of the branch 
+    (rldot), the parameter values (par) and the first two of them (p1, 
+    p2).
+    '''
     def __init__(self):
         self.ctrl = None
         self.sol  = None
         self.drv  = None
+        self.icp  = None
+        self.rldot = None
+        self.par  = None
         self.p1   = None
         self.p2   = None
 
@@ -46,55 +60,154 @@ def parse_sl(file_name):
     named file_name and returns the solutions.
     '''
     print('Warning! Function is obsolete, use parseSolution instead!')
-    parseSolution(file_name)
-    
-def parseSolution(file_name):
+    return parseSolution(file_name)
+
+def _readSolution(f, header):
+    '''
+    Function reads the block of solution file f (opened in binary mode)
+    following the given header line and returns it as Solution.
+    '''
+    s = Solution()
+    s.ctrl = np.array(header.split(), dtype=int)
+    (nfpr, ntpl, nar, nrow) = (s.ctrl[4], s.ctrl[6], s.ctrl[7], s.ctrl[8])
+    # Rows of the block are wrapped, so the block is parsed as a whole
+    d = np.array(b''.join([f.readline() for i in range(nrow)]).split(), 
+                 dtype=float)
+    n = ntpl*nar
+    if len(d) < n+2*nfpr+ntpl*(nar-1):
+        raise ValueError('Truncated solution block (label %i)' % s.ctrl[3])
+    s.sol = d[:n].reshape(ntpl, nar)
+    s.icp = d[n:n+nfpr].astype(int)
+    s.rldot = d[n+nfpr:n+2*nfpr]
+    n += 2*nfpr
+    s.drv = d[n:n+ntpl*(nar-1)].reshape(ntpl, nar-1)
+    s.par = d[n+ntpl*(nar-1):]
+    if len(s.par) > 1:
+        (s.p1, s.p2) = (s.par[0], s.par[1])
+    return s
+
+def iterSolutions(file_name, types=(4, 5)):
+    '''
+    Generator yields solutions of XPPAut generated solution file (one with
+    extension 'q') named file_name one by one, without keeping them in 
+    memory. Only solutions of the given types (by default 4 and 5, i.e.
+    regular points and limit points of periodic orbits) are parsed, others
+    are skipped; types=None yields all of them.
+    '''
+    f = open(file_name, 'rb')
+    try:
+        while True:
+            header = f.readline()
+            if len(header) == 0:
+                break
+            ctrl = header.split()
+            if len(ctrl) == 0:
+                continue
+            if types is None or int(ctrl[2]) in types:
+                yield _readSolution(f, header)
+            else:
+                for i in range(int(ctrl[8])):
+                    f.readline()
+    finally:
+        f.close()
+
+def parseSolution(file_name, types=(4, 5)):
     '''
     Function parses XPPAut generated solution file (one with extension 'q')
-    named file_name and returns the solutions.
+    named file_name and returns the solutions (of the given types, see 
+    iterSolutions). Each block is located by its header (which gives the 
+    number of its lines) and parsed in bulk.
     '''
-    f = open(file_name, 'r')
+    return list(iterSolutions(file_name, types))
 
-    i = -1
-    sols = []
-    for l in f:
-        ll = l.split()
-
-        # If it's user RG or LP, start to colect data
-        if len(ll) == 13 and (int(ll[2]) == 4 or int(ll[2]) == 5):
-            s = Solution()
-            s.ctrl = np.array(ll, np.int)
-            s.sol = np.ones((s.ctrl[6],s.ctrl[7]))*np.NaN
-            s.drv = np.ones((s.ctrl[6],s.ctrl[7]-1))*np.NaN
-            i = 0
-            
-            # We're loading data now
-            if i >= 0:
-                # Writting solution
-                if i < s.ctrl[6]:
-                    s.sol[i,:] = np.array(ll, np.float)
-                # Skipping a line
-                elif i == s.ctrl[6]:
-                    i += 1
-                    continue
-                # Writting derivatives (?)
-                elif i < 2*s.ctrl[6] + 1:
-                    ii = i - s.ctrl[6] - 1;
-                    s.drv[ii,:] = np.array(ll, np.float)
-                elif i == 2*s.ctrl[6] + 1:
-                    s.p1 = float(ll[0])
-                    s.p2 = float(ll[1])
-                # Incrementing counter
-                i += 1
-                # Checking if we're at the end of the block
-                if i >= s.ctrl[8]:
-                    i = -1
-                    sols.append(s)
-                else:
-                    continue
+# Columns of the solution file index
+index_columns = ['offset', 'branch', 'point', 'type', 'label', 'nfpr', 
+                 'ntpl', 'nar', 'nrow']
+
+def indexFile(file_name):
+    '''
+    Function returns the name of the index file of solution file file_name.
+    '''
+    return file_name+'.idx'
 
+def buildIndex(file_name, save=True):
+    '''
+    Function scans solution file file_name once and returns its index: an
+    integer array with a row per solution and columns index_columns (byte
+    offset of the header, branch, point, type, label and block sizes).
+    If save=True (default) the index is stored next to the file (see 
+    indexFile); it is not saved if the directory is not writable.
+    '''
+    rows = []
+    f = open(file_name, 'rb')
+    while True:
+        off = f.tell()
+        header = f.readline()
+        if len(header) == 0:
+            break
+        ctrl = header.split()
+        if len(ctrl) == 0:
+            continue
+        ctrl = [int(c) for c in ctrl[:9]]
+        rows.append([off]+ctrl[:5]+ctrl[6:9])
+        for i in range(ctrl[8]):
+            f.readline()
     f.close()
+    index = np.array(rows, dtype=np.int64).reshape(len(rows), len(index_columns))
+    if save:
+        try:
+            f = open(indexFile(file_name), 'wb')
+            np.save(f, index)
+            f.close()
+        except (IOError, OSError):
+            pass
+    return index
+
+def loadIndex(file_name):
+    '''
+    Function returns the index of solution file file_name (see buildIndex);
+    the stored index is used if it is up to date, otherwise it is rebuilt.
+    '''
+    idx = indexFile(file_name)
+    if os.path.exists(idx) and os.path.getmtime(idx) >= os.path.getmtime(file_name):
+        return np.load(idx)
+    return buildIndex(file_name)
 
+def findSolutions(file_name, labels=None, types=None, branches=None):
+    '''
+    Function returns the rows of solution file index (see buildIndex) 
+    matching the given labels, types and branches (lists; None matches
+    everything).
+    '''
+    index = loadIndex(file_name)
+    keep = np.ones(len(index), dtype=bool)
+    for (col, values) in ((4, labels), (3, types), (1, branches)):
+        if values is not None:
+            keep &= np.isin(index[:,col], values)
+    return index[keep]
+
+def getSolution(file_name, label):
+    '''
+    Function returns the solution with the given label from solution file
+    file_name (or None if there is no such label); only its block is read,
+    located with the file index (see loadIndex).
+    '''
+    rows = findSolutions(file_name, labels=[label])
+    if len(rows) == 0:
+        return None
+    return readSolutions(file_name, rows[:1])[0]
+
+def readSolutions(file_name, rows):
+    '''
+    Function reads the solutions of the given index rows (see 
+    findSolutions) from solution file file_name.
+    '''
+    sols = []
+    f = open(file_name, 'rb')
+    for r in rows:
+        f.seek(int(r[0]))
+        sols.append(_readSolution(f, f.readline()))
+    f.close()
     return sols
 
 def parse_bf(file_name):
@@ -103,28 +216,115 @@ def parse_bf(file_name):
     named file_name and returns the solutions.
     '''
     print('Warning! Function is obsolete, use parseBifDiag instead!')
-    parseBifDiag(file_name)
+    return parseBifDiag(file_name)
 
-def parseBifDiag(file_name):
+def _lineFields(buf, block=2**22):
+    '''
+    Function returns positions of the new lines in the text buffer buf 
+    (uint8 array ending with a new line), the numbers of whitespace 
+    separated fields in the lines and the positions of their first fields
+    (the new line for empty lines). The buffer is scanned in blocks of 
+    block bytes, so temporary arrays stay small.
+    '''
+    nl = [np.flatnonzero(buf[i:i+block] == ord('\n'))+i 
+          for i in range(0, len(buf), block)]
+    nl = np.concatenate(nl) if len(nl) > 0 else np.zeros(0, int)
+    lens = np.zeros(len(nl), int)
+    first = np.full(len(nl), len(buf)-1)
+    for i in range(0, len(buf), block):
+        b = buf[i:i+block]
+        # Fields start with a non-space character following a space
+        start = b > 32
+        start[1:] &= b[:-1] <= 32
+        if i > 0:
+            start[0] &= buf[i-1] <= 32
+        start = np.flatnonzero(start)+i
+        line = np.searchsorted(nl, start)
+        lens += np.bincount(line, minlength=len(nl))
+        # The first fields of the lines (which may begin in earlier blocks)
+        new = np.ones(len(line), dtype=bool)
+        new[1:] = line[1:] != line[:-1]
+        (line, start) = (line[new], start[new])
+        new = first[line] == len(buf)-1
+        first[line[new]] = start[new]
+    return (nl, lens, first)
+
+def _mergedSigns(buf, block=2**22):
+    '''
+    Function returns positions of minus signs merged with the preceding 
+    number (e.g. branch and point) in the text buffer buf.
+    '''
+    minus = [np.flatnonzero(buf[i:i+block] == ord('-'))+i 
+             for i in range(1, len(buf), block)]
+    if len(minus) == 0:
+        return np.zeros(0, int)
+    minus = np.concatenate(minus)
+    prev = buf[minus-1]
+    return minus[((prev >= ord('0')) & (prev <= ord('9'))) | (prev == ord('.'))]
+
+def parseBifDiag(file_name, integers=False):
     '''
     Function parses XPPAut generated bif. diagram file (one with extension 'p')
-    named file_name and returns the data.
+    named file_name and returns the data: an array with a row per point and
+    columns branch, point, type, label and the values. Rows of normal 
+    branches (branch > 0) get a 0 period column appended; rows shorter 
+    than the others are padded with 0.
+    If integers=True (default False) a pair of arrays is returned instead: 
+    integer columns (branch, point, type, label) and float values.
     '''
     print('Parsing bifurcation diagram file:',file_name)
-    f = open(file_name, 'r')
-    d = []
-    for l in f:
-        ll = l.split()
-        if ll[0] != '0':
-            # Fix for merging '-' sign for lond point number
-            if ll[0].rfind('-') > 0:
-                ll_rest = ll[1:]
-                ll = ll[0].rsplit('-',1)
-                ll[1] = '-'+ll[1]
-                ll.extend(ll_rest)
-            # If it's 'normal' branch, append period column 
-            if int(ll[0]) > 0:
-                ll.append('0')
-            d.append(ll)
-    f.close()
-    return np.array(d, np.float)
+    buf = np.fromfile(file_name, dtype=np.uint8)
+    if buf.size == 0 or buf[-1] != ord('\n'):
+        buf = np.append(buf, np.uint8(ord('\n')))
+    
+    # Header lines (first field '0') are dropped
+    (nl, lens, first) = _lineFields(buf)
+    header = (lens > 0) & (buf[first] == ord('0')) & \
+             (buf[np.minimum(first+1, len(buf)-1)] <= 32)
+    # Numbers merged by a minus sign are split
+    minus = _mergedSigns(buf)
+    line = np.searchsorted(nl, minus)
+    (minus, line) = (minus[~header[line]], line[~header[line]])
+    lens += np.bincount(line, minlength=len(nl))
+    lens = lens[(lens > 0) & ~header]
+    
+    # Text without the headers and with the spaces inserted; the cuts are
+    # (position, end of skipped text, number of inserted spaces)
+    header = np.flatnonzero(header)
+    (begins, ends) = (np.r_[0, nl+1][header], nl[header]+1)
+    cuts = sorted(zip(np.r_[begins, minus].tolist(), np.r_[ends, minus].tolist(),
+                      [0]*len(header)+[1]*len(minus)))
+    text = np.full(len(buf)+len(minus)-(ends-begins).sum(), ord(' '), 
+                   dtype=np.uint8)
+    (i, j) = (0, 0)
+    for (pos, end, sp) in cuts:
+        text[j:j+pos-i] = buf[i:pos]
+        j += pos-i+sp
+        i = end
+    text[j:] = buf[i:]
+    del buf
+    text = text.tobytes()
+    
+    # Values are parsed straight from the text (no per field objects)
+    values = np.zeros(0)
+    if lens.sum() > 0:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', DeprecationWarning)
+            values = np.fromstring(text, sep=' ')
+    del text
+    if values.shape[0] != lens.sum():
+        raise ValueError('Wrong bifurcation diagram data in file: '+file_name)
+    offsets = np.cumsum(lens)-lens
+    # Normal branches (branch > 0) get the 0 period column appended
+    width = lens + (values[offsets] > 0)
+    data = np.zeros((len(lens), width.max() if len(lens) else 0))
+    # Values are copied in blocks of rows, the index arrays stay small
+    rows = max(2**20//max(data.shape[1], 1), 1)
+    for i in range(0, len(lens), rows):
+        (l, o) = (lens[i:i+rows], offsets[i:i+rows])
+        pos = np.repeat((np.arange(len(l))+i)*data.shape[1]-o, l)
+        pos += np.arange(o[0], o[0]+len(pos))
+        data.ravel()[pos] = values[o[0]:o[0]+len(pos)]
+    if integers:
+        return (data[:,:4].astype(int), data[:,4:])
+    return data